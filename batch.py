@@ -0,0 +1,209 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+from functools import partial
+from os import cpu_count
+from shutil import rmtree
+from tempfile import mkdtemp
+from sys import platform
+from time import perf_counter
+try:
+    from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+except ImportError:
+    # The resource module only exists on Unix
+    getrusage = None
+from profiling import log_entry, print_summary, profiled, merge_profiles
+from writer import start_writers, stop_writers, finish_writes, flush_writes, note_sizes
+
+def pattern_seeds(s: int, n: int):
+    """Returns one seed sequence per pattern, all derived from a single root seed"""
+
+    # Initialise root seed for RNG
+    if s == 0:
+        root = np.random.SeedSequence()
+    else:
+        root = np.random.SeedSequence(s)
+
+    if n == 1:
+        return [root]
+
+    print(f"Root seed: {root.entropy}")
+
+    # One child per pattern, the same children root.spawn(n) would give
+    return [child_seed(root, (i,)) for i in range(n)]
+
+def child_seed(root: any, key: tuple):
+    """Returns the child of a root seed sequence with the given spawn key, turned into its own seed number"""
+
+    # The child is addressed by its key, so it can be recreated without spawning all children before it.
+    # Each child is turned into its own seed number, so every pattern can still be recreated on its own with -s.
+    child = np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + tuple(key))
+    state = child.generate_state(4, dtype=np.uint32)
+    return np.random.SeedSequence(int.from_bytes(state.tobytes(), "little"))
+
+# Constants of the hash numpy's SeedSequence mixes its entropy with
+POOL_SIZE = 4
+INIT_A = 0x43b0d7e5
+MULT_A = 0x931e8875
+INIT_B = 0x8b51f9dd
+MULT_B = 0x58f38ded
+MIX_MULT_L = 0xca01f9dd
+MIX_MULT_R = 0x4973f715
+XSHIFT = 16
+
+def uint32_words(value: int):
+    """Splits a non-negative integer into 32 bit words, least significant first, like SeedSequence does with its entropy"""
+
+    words = [value & 0xffffffff]
+    value >>= 32
+    while value > 0:
+        words.append(value & 0xffffffff)
+        value >>= 32
+    return words
+
+def child_entropies(root: any, key: tuple, indices: np.ndarray):
+    """Returns the seed numbers child_seed(root, key + (i,)) gives for many i at once
+
+    The SeedSequence hash is computed on an array with one row per child, so no seed sequence is made per child.
+    """
+
+    indices = np.asarray(indices, dtype=np.uint64)
+    if len(indices) > 0 and indices.max() > 0xffffffff:
+        raise Exception("Child indices have to fit in 32 bits.")
+
+    # The entropy of a child is the entropy of the root, padded to the pool size, followed by the words of its spawn key
+    run = uint32_words(root.entropy)
+    run += [0] * (POOL_SIZE - len(run))
+    prefix = run + [word for k in root.spawn_key + tuple(key) for word in uint32_words(k)]
+    entropy = np.empty((len(indices), len(prefix) + 1), dtype=np.uint32)
+    entropy[:, :-1] = prefix
+    entropy[:, -1] = indices
+
+    hash_const = INIT_A
+
+    def hashmix(value):
+        nonlocal hash_const
+        value = value ^ np.uint32(hash_const)
+        hash_const = (hash_const * MULT_A) & 0xffffffff
+        value = value * np.uint32(hash_const)
+        return value ^ (value >> XSHIFT)
+
+    def mix(x, y):
+        result = np.uint32(MIX_MULT_L) * x - np.uint32(MIX_MULT_R) * y
+        return result ^ (result >> XSHIFT)
+
+    # Mix the entropy into the pool, the same steps SeedSequence.mix_entropy takes
+    pool = [hashmix(entropy[:, i]) for i in range(POOL_SIZE)]
+    for i_src in range(POOL_SIZE):
+        for i_dst in range(POOL_SIZE):
+            if i_src != i_dst:
+                pool[i_dst] = mix(pool[i_dst], hashmix(pool[i_src]))
+    for i_src in range(POOL_SIZE, entropy.shape[1]):
+        for i_dst in range(POOL_SIZE):
+            pool[i_dst] = mix(pool[i_dst], hashmix(entropy[:, i_src]))
+
+    # generate_state(4, dtype=np.uint32) of every child
+    hash_const = INIT_B
+    state = np.empty((len(indices), POOL_SIZE), dtype="<u4")
+    for i in range(POOL_SIZE):
+        value = pool[i] ^ np.uint32(hash_const)
+        hash_const = (hash_const * MULT_B) & 0xffffffff
+        value = value * np.uint32(hash_const)
+        state[:, i] = value ^ (value >> XSHIFT)
+
+    # The four words of a child are one 128 bit seed number, least significant word first
+    halves = state.view("<u8").tolist()
+    return [low | high << 64 for low, high in halves]
+
+def peak_memory():
+    """Returns the peak resident memory in MB of this process or of the largest finished worker process, None if it cannot be measured"""
+
+    if getrusage is None:
+        return None
+    peak = max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss)
+
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    if platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+def run_batch(job: any, seeds: list, workers: int, profile_log: str = None, profile_dump: str = None, writers: int = 0, compress_level: int = 6):
+    """Runs job once for every seed, spread over a pool of worker processes, and prints the progress
+
+    With profile_log, the stage records every job returns are logged as JSON lines and summarized at the end,
+    once the sizes of the images written in the background are known.
+    With profile_dump, every job runs under cProfile and the statistics of all jobs are merged into one file.
+    Every process writes its PNG images with writers background threads, a failed write stops the batch.
+    """
+
+    # Without patterns there is nothing to do, and no pool can be made with 0 workers
+    if not seeds:
+        return
+
+    if workers == 0:
+        workers = cpu_count()
+    workers = min(workers, len(seeds))
+
+    start = perf_counter()
+    total = len(seeds)
+
+    if profile_dump is not None:
+        dump_dir = mkdtemp()
+        job = partial(profiled, job, dump_dir)
+
+    log = None
+    entries = []
+    if profile_log is not None:
+        log = open(profile_log, "w")
+
+    sizes = {}
+
+    def finished(done, entry):
+        print(f"{done}/{total} patterns")
+        if log is not None:
+            entries.append(entry)
+
+    # A single worker runs in this process, there is nothing to gain from a pool.
+    # Its images are written while the next pattern is drawn, the last ones are waited for at the end.
+    if workers == 1:
+        start_writers(writers, compress_level)
+        try:
+            for done, seed in enumerate(seeds, start=1):
+                finished(done, job(seed))
+            sizes = finish_writes()
+        finally:
+            stop_writers()
+    else:
+        # Every worker writes its images while it draws the next pattern, a failed write fails its next pattern.
+        # The images still being written are waited for once per worker at the end.
+        with Manager() as manager, ProcessPoolExecutor(max_workers=workers, initializer=start_writers, initargs=(writers, compress_level)) as executor:
+            barrier = manager.Barrier(workers)
+            futures = [executor.submit(job, seed) for seed in seeds]
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    finished(done, future.result())
+                for future in [executor.submit(flush_writes, barrier) for _ in range(workers)]:
+                    sizes.update(future.result())
+            except BaseException:
+                # The patterns that did not start yet are not made after a failure, and no worker waits for the others to flush
+                barrier.abort()
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    elapsed = perf_counter() - start
+    print(f"Generated {total} patterns in {elapsed:.2f} s with {workers} worker(s) ({total / elapsed:.2f} patterns/s)")
+
+    if log is not None:
+        for entry in entries:
+            note_sizes(entry["stages"], sizes)
+            log_entry(log, entry)
+        log.close()
+        print_summary(entries)
+    if profile_dump is not None:
+        merge_profiles(dump_dir, profile_dump)
+        rmtree(dump_dir)
+
+    # Useful to size the number of workers for large images
+    peak = peak_memory()
+    if peak is not None:
+        print(f"Peak memory per process: {peak:.0f} MB")
@@ -0,0 +1,199 @@
+import argparse
+import json
+import numpy as np
+import matplotlib.pyplot as plt
+import platform
+import tracemalloc
+from os.path import isfile
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import square
+import iso
+import polar
+from batch import peak_memory
+from profiling import take_records
+
+"""
+Times the stages of square.py, iso.py and polar.py over a grid of sizes.
+Every case is run once per seed with the stages timed, and once more with tracemalloc to find the peak memory of every stage.
+The peak memory covers what numpy and Python allocate, not the buffers matplotlib allocates inside Agg.
+Seeds are read from loops.json, so every run draws and fills exactly the same patterns.
+"""
+
+def square_case(params: dict, seed: int, output_path: str, stage: any):
+    """Draws and fills one square pattern, timing every stage"""
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    x_seed = rng.binomial(1, 0.5, params["x"]+1)
+    y_seed = rng.binomial(1, 0.5, params["x"]+1)
+
+    if params["renderer"] == "numpy":
+        img = stage("draw", square.rasterize, x_seed, y_seed, seed, None, params["width"], params["width"], False, 0.04, params["dpi"])
+    else:
+        img = stage("draw", square.draw, x_seed, y_seed, seed, None, params["width"], params["width"], False, 0.04, params["dpi"])
+    stage("fill", square.fill, "viridis", "transparent", rng, seed, img, output_path)
+
+def iso_case(params: dict, seed: int, output_path: str, stage: any):
+    """Draws and fills one isometric pattern, timing every stage"""
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    x_1_seed = rng.binomial(1, 0.5, params["x"])
+    x_2_seed = rng.binomial(1, 0.5, params["x"])
+    y_seed = rng.binomial(1, 0.5, params["x"])
+
+    if params["renderer"] == "numpy":
+        labels, ink = stage("draw", iso.rasterize, x_1_seed, x_2_seed, y_seed, seed, None, params["width"], params["width"], params["dpi"], 1.6 / params["downscale"])
+        stage("fill", iso.fill_rasterized, "viridis", rng, seed, "transparent", labels, ink, output_path)
+    else:
+        img = stage("draw", iso.draw, x_1_seed, x_2_seed, y_seed, seed, None, params["width"], params["width"], params["dpi"], params["downscale"])
+        stage("fill", iso.fill, "viridis", rng, seed, "transparent", params["downscale"], img, output_path)
+
+def polar_case(params: dict, seed: int, output_path: str, stage: any):
+    """Draws and fills one polar pattern, timing every stage"""
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    circle_seed = rng.binomial(1, 0.5, params["x1"])
+    radial_seed = rng.binomial(1, 0.5, params["x2"])
+
+    if params["renderer"] == "numpy":
+        labels, ink = stage("draw", polar.rasterize, params["x1"], circle_seed, params["x2"], radial_seed, [0], seed, None, params["width"], params["width"], params["dpi"], 1.6 / params["downscale"])
+        stage("fill", polar.fill_rasterized, "viridis", rng, seed, "transparent", labels, ink, output_path)
+    else:
+        img = stage("draw", polar.draw, params["x1"], circle_seed, params["x2"], radial_seed, [0], seed, None, params["width"], params["width"], params["dpi"], params["downscale"])
+        stage("fill", polar.fill, "viridis", rng, seed, "transparent", params["downscale"], img, output_path)
+
+def benchmark_cases():
+    """Returns the grid of cases to benchmark as (script, parameters) pairs"""
+
+    cases = []
+    for x in [50, 100, 200, 400]:
+        for renderer in ["agg", "numpy"]:
+            cases.append(("square", {"x": x, "width": 10, "dpi": 100, "renderer": renderer}))
+    for renderer in ["agg", "numpy"]:
+        cases.append(("square", {"x": 100, "width": 10, "dpi": 200, "renderer": renderer}))
+    for x in [50, 100, 200]:
+        for renderer, downscale in [("agg", 1), ("agg", 2), ("numpy", 2)]:
+            cases.append(("iso", {"x": x, "width": 10, "dpi": 100, "downscale": downscale, "renderer": renderer}))
+    for x1, x2 in [(25, 49), (50, 99), (100, 199)]:
+        for renderer, downscale in [("agg", 1), ("agg", 2), ("numpy", 2)]:
+            cases.append(("polar", {"x1": x1, "x2": x2, "width": 5, "dpi": 100, "downscale": downscale, "renderer": renderer}))
+    return cases
+
+def case_name(script: str, params: dict):
+    """Returns a readable name of a case, used to match it against a baseline"""
+    return script + " " + " ".join(f"{key}={value}" for key, value in params.items())
+
+def fixed_seeds(path: str, num_seeds: int):
+    """Returns the first seed numbers stored in loops.json"""
+
+    with open(path, "r") as file:
+        loops = json.load(file)
+    seeds = [int(seed) for seed in next(iter(loops.values()))]
+    return seeds[:num_seeds]
+
+def run_case(script: str, params: dict, seeds: list):
+    """Times every stage of a case once per seed, then measures the peak memory of every stage once"""
+
+    case = {"square": square_case, "iso": iso_case, "polar": polar_case}[script]
+    times = {}
+    peaks = {}
+
+    def timed(name, function, *args):
+        start = perf_counter()
+        result = function(*args)
+        times.setdefault(name, []).append(perf_counter() - start)
+        return result
+
+    def traced(name, function, *args):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        peaks[name] = (tracemalloc.get_traced_memory()[1] - before) / 2**20
+        return result
+
+    with TemporaryDirectory() as output_path:
+        for seed in seeds:
+            case(params, seed, output_path, timed)
+            plt.close("all")
+            # The scripts also record their own stages for --profile, those are not needed here
+            take_records()
+
+        tracemalloc.start()
+        case(params, seeds[0], output_path, traced)
+        tracemalloc.stop()
+        plt.close("all")
+        take_records()
+
+    return [{"name": case_name(script, params), "script": script, "params": params, "stage": name,
+             "seconds": median(times[name]), "times": times[name], "peak_mb": peaks[name]} for name in times]
+
+def compare(results: list, baseline_path: str, threshold: float):
+    """Prints every stage next to its baseline, returns the number of regressions"""
+
+    with open(baseline_path, "r") as file:
+        baseline = json.load(file)
+    baseline = {(result["name"], result["stage"]): result for result in baseline["results"]}
+
+    regressions = 0
+    for result in results:
+        old = baseline.get((result["name"], result["stage"]))
+        if old is None:
+            print(f"{result['name']} {result['stage']}: not in baseline")
+            continue
+
+        # A stage regresses when it is slower or uses more memory than the baseline by more than the threshold
+        slower = result["seconds"] > old["seconds"] * (1 + threshold)
+        larger = result["peak_mb"] > old["peak_mb"] * (1 + threshold)
+        flag = "REGRESSION" if slower or larger else "ok"
+        regressions += slower or larger
+        print(f"{result['name']} {result['stage']}: {old['seconds']:.3f} -> {result['seconds']:.3f} s, "
+              f"{old['peak_mb']:.0f} -> {result['peak_mb']:.0f} MB {flag}")
+    return regressions
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        description="Benchmarks drawing and filling hitomezashi patterns in square, iso and polar grids. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument("-o", type=str, default="benchmark.json", help="JSON file to write the results to.")
+    parser.add_argument("--seeds", type=str, default="loops.json", help="File to read the fixed seed numbers from.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of seeds every case is run with.")
+    parser.add_argument("--filter", type=str, default="", help="Only run the cases whose name contains this text (e.g. 'polar' or 'renderer=numpy').")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON file to compare the results against.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Fraction by which a stage may be slower or use more memory than the baseline before it is flagged.")
+    args=parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+
+    if not isfile(args.seeds):
+        raise Exception(f"Seed file '{args.seeds}' does not exist.")
+    seeds = fixed_seeds(args.seeds, args.repeat)
+
+    results = []
+    for script, params in benchmark_cases():
+        if args.filter not in case_name(script, params):
+            continue
+        for result in run_case(script, params, seeds):
+            print(f"{result['name']} {result['stage']}: {result['seconds']:.3f} s, {result['peak_mb']:.0f} MB")
+            results.append(result)
+
+    report = {
+        "settings": {"seeds": [str(seed) for seed in seeds], "python": platform.python_version(), "numpy": np.__version__,
+                     "platform": platform.platform(), "peak_rss_mb": peak_memory()},
+        "results": results
+    }
+    with open(args.o, "w") as file:
+        json.dump(report, file, indent=1)
+
+    if args.compare is not None:
+        regressions = compare(results, args.compare, args.threshold)
+        print(f"{regressions} regression(s) against {args.compare}")
+        if regressions > 0:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import numpy as np
+from glob import glob
+from os import makedirs, remove, replace, stat, utime, getpid
+
+"""
+Uncolored patterns only depend on the geometry, the seeds and the size of the image, not on the colormap or the background.
+Rendered patterns (or their label maps) are stored under a hash of everything they depend on, one .npz file per pattern:
+<cache dir>/<first two characters of the key>/<key>.npz
+The cache is bounded in size, the patterns that were used least recently are removed first.
+"""
+
+# Changes whenever the renderers draw a different image from the same parameters, so old entries are not used anymore
+CACHE_VERSION = 1
+
+def pattern_key(geometry: str, seeds: list, params: dict):
+    """Returns the hash of everything an uncolored pattern depends on"""
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": CACHE_VERSION, "geometry": geometry, "params": params}, sort_keys=True).encode())
+    for seed in seeds:
+        seed = np.asarray(seed, dtype=np.uint8)
+        # The length goes in first, so seeds of different lengths never hash the same
+        digest.update(np.int64(len(seed)).tobytes())
+        digest.update(seed.tobytes())
+    return digest.hexdigest()
+
+def cache_path(cache_dir: str, key: str):
+    """Returns the file a pattern is stored in"""
+    return cache_dir + "/" + key[:2] + "/" + key + ".npz"
+
+def cache_load(cache_dir: str, key: str):
+    """Returns the arrays stored under a key, None if the pattern is not in the cache"""
+
+    path = cache_path(cache_dir, key)
+    try:
+        with np.load(path) as stored:
+            arrays = {name: stored[name] for name in stored.files}
+    except FileNotFoundError:
+        return None
+
+    # The modification time is the last time the pattern was used, eviction goes by it.
+    # Another process may just have evicted it, the arrays are already read.
+    try:
+        utime(path)
+    except FileNotFoundError:
+        pass
+    return arrays
+
+def cache_store(cache_dir: str, key: str, arrays: dict, max_bytes: int):
+    """Stores arrays under a key, then evicts the least recently used patterns until the cache fits in max_bytes
+
+    Returns the size of the stored file in bytes.
+    """
+
+    path = cache_path(cache_dir, key)
+    makedirs(cache_dir + "/" + key[:2], exist_ok=True)
+
+    # Written to a temporary file first, so other processes never read half a pattern
+    temporary = path + "." + str(getpid()) + ".tmp"
+    with open(temporary, "wb") as file:
+        np.savez_compressed(file, **arrays)
+    replace(temporary, path)
+    size = stat(path).st_size
+
+    evict(cache_dir, max_bytes)
+    return size
+
+def evict(cache_dir: str, max_bytes: int):
+    """Removes the least recently used patterns until the cache fits in max_bytes"""
+
+    entries = []
+    for path in glob(cache_dir + "/*/*.npz"):
+        try:
+            info = stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
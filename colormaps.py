@@ -0,0 +1,76 @@
+import numpy as np
+from functools import lru_cache
+
+# metbrewer imports the colour package and builds a large dict of palettes, it is only imported when a palette is asked for
+
+# The matplotlib colormaps
+CMAPS = {
+    "uniform": ['viridis', 'plasma', 'inferno', 'magma', 'cividis'],
+    "sequential": ['Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
+                  'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
+                  'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn'],
+    "sequential2": ['binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
+                  'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
+                  'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper'],
+    "diverging": ['PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu', 'RdYlBu',
+                  'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic',
+                  'berlin', 'managua', 'vanimo'],
+    "cyclic": ['twilight', 'twilight_shifted', 'hsv'],
+    "qualitative": ['Pastel1', 'Pastel2', 'Paired', 'Accent', 'Dark2',
+                  'Set1', 'Set2', 'Set3', 'tab10', 'tab20', 'tab20b',
+                  'tab20c'],
+    "misc": ['flag', 'prism', 'ocean', 'gist_earth', 'terrain',
+                  'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
+                  'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
+                  'turbo', 'nipy_spectral', 'gist_ncar']
+}
+
+def colormap_names(c: str):
+    """Returns the names of the colormaps the -c argument can draw from"""
+
+    cmaps_list = []
+    if c == "all":
+        from metbrewer import return_met_palettes
+        for cmap_name in CMAPS:
+            for item in CMAPS[cmap_name]:
+                cmaps_list.append(item)
+        for cmap_name in return_met_palettes():
+            cmaps_list.append(cmap_name)
+    elif c == "metbrewer":
+        from metbrewer import return_met_palettes
+        for cmap_name in return_met_palettes():
+            cmaps_list.append(cmap_name)
+    elif c in CMAPS:
+        for item in CMAPS[c]:
+            cmaps_list.append(item)
+    else:
+        cmaps_list.append(c)
+    return cmaps_list
+
+@lru_cache(maxsize=None)
+def colormap_lut(cmap: str):
+    """Resolves a colormap once into a lookup table of RGBA uint8 colors"""
+
+    from matplotlib import colormaps
+    from matplotlib.colors import ListedColormap
+
+    # No matplotlib colormap has the name of a metbrewer palette
+    if cmap in colormaps:
+        my_cmap = colormaps[cmap]
+    else:
+        from metbrewer import met_brew, return_met_palettes
+        # Asking for all colors of the palette gives the same discrete colors, without met_brew printing them
+        colors = met_brew(cmap, n=len(return_met_palettes()[cmap]["colors"]))
+        my_cmap = ListedColormap(colors)
+
+    # Continuous colormaps have 256 colors, listed colormaps have one entry per color
+    lut = my_cmap(np.arange(my_cmap.N), bytes=True)
+    lut.flags.writeable = False
+    return lut
+
+def lut_colors(lut: np.ndarray, values: np.ndarray):
+    """Looks up the colors of values between 0 and 1, the same way a matplotlib colormap does"""
+
+    index = (np.asarray(values, dtype=np.float64) * len(lut)).astype(np.intp)
+    index = np.clip(index, 0, len(lut) - 1)
+    return lut[index]
@@ -1,271 +1,255 @@
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
+import argparse
 import numpy as np
-from skimage.segmentation import flood
-from skimage.io import imread, imsave
-from skimage.color import rgb2gray
-from os.path import isfile
-from os import makedirs
-import json
-import gc
-
-def load_db(path):
-	with open(path, "r") as file:
-		db = json.load(file)
-	return db
-
-def save_db(db, path):
-	with open(path, "w") as file:
-		json.dump(db, file, indent=4)
-
-def draw(
-        x_seed: list,
-        y_seed: list,
-        random_seed: int,
-        output_path: str,
-        width: float,
-        height: float,
-        padding: float,
-        dpi: int,
-        border: bool
-        ):
-    """Generates a square hitomezashi pattern"""
-
-    # Initialise figure.
-    """
-    We want to expand the size of the figure slightly because the frameon takes up space in the figure.
-    For example, if width/height=10, dpi=100, and x=200; we expect every square to take up 5 pixels, perfectly filling up the space.
-    However, because the frameon takus up space, the 200 squares have 999 pixels, causing some squares to be 4 pixel wide/high.
-    To compensate we make the figure larger by one pixel.
-    """
-    one_pixel = 1 / dpi # inch per pixel
-    fig_width = np.round(width * (1 + padding) + one_pixel, 2) # in inches
-    fig_height = np.round(height * (1 + padding) + one_pixel, 2) # in inches
-    fig1 = plt.figure(figsize=(fig_width, fig_height))
-
-    """
-    Here we add the padding to the figure.
-    The amount of padding (in pixels) being added is height/width * dpi * padding.
-    So if the padding=0.02 (2%), height/width=10, and dpi=100; the amount of padding added is 20 pixels.
-    Keep in mind that 20 pixels here means that 10 pixels get added to the left/top and 10 to the right/bottom
-    """
-    ratio = (width * dpi) / (width * dpi * (1 + padding) + one_pixel)
-    width_padding = round(ratio * padding * (width * dpi * (1 + padding)) + 1) # in pixels
-    height_padding = round(ratio * padding * (height * dpi * (1 + padding)) + 1) # in pixels
-    ax1 = fig1.add_axes([(ratio * padding / 2),(ratio * padding / 2),(1 - (width_padding / round(fig_width * dpi))),(1 - (height_padding / round(fig_height * dpi)))], frameon=border)
-    fig1.patch.set_visible(True)
-    fig1.patch.set_facecolor('white')
-
-    # Disable axes ticks and labels
-    plt.tick_params(
-        axis='both',
-        which='both',
-        bottom=False,
-        top=False,
-        left=False,
-        right=False,
-        labelbottom=False,
-        labelleft=False
+from lattice import count_loops_regions_batch, count_loops_regions_streaming
+from batch import child_entropies
+from profiling import stage, take_records, log_entry, print_summary, profiled, merge_profiles
+from os.path import isfile, dirname
+from os import cpu_count, fsync, close, truncate
+from functools import partial
+from shutil import rmtree
+from tempfile import mkdtemp
+from store import create_store, open_store, append_samples, read_samples, is_compact, SAMPLE_DTYPE
+from stats import new_accumulator, accumulate, interval_width, samples_needed, read_stats, write_stats
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+# Number of pixels labeled at once when counting a batch of samples, batches of large grids are smaller.
+# Grids that do not fit on their own are counted row by row.
+BATCH_PIXELS = 1 << 22
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        description="Counts the loops and regions of square hitomezashi patterns over a range of grid sizes. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
         )
-
-    # Will contain our lines we need to draw
-    lines = []
-
-    # Generate horizontal lines
-    for i in range(0,len(x_seed)):
-        seed = x_seed[i]
-        for j in range(0,len(y_seed)-1, 2):
-            y1 = i
-            y2 = i
-            x1 = j + seed
-            x2 = j + 1 + seed
-            lines.append(((x1,y1), (x2,y2)))
-
-    # Generate vertical lines
-    for i in range(0,len(y_seed)):
-        seed = y_seed[i]
-        for j in range(0,len(x_seed)-1, 2):
-            y1 = j + seed
-            y2 = j + 1 + seed
-            x1 = i
-            x2 = i
-            lines.append(((x1,y1), (x2,y2)))
-
-    # Draw our lines
-    ln_coll = LineCollection(lines,
-                        colors="black",
-                        linewidths=0.5,
-                        zorder=8,
-                        antialiased=False
-                        )
-    ax1.add_collection(ln_coll)
-
-
-    if border:
-        plt.xlim((0,len(x_seed)-1))
-        plt.ylim((0,len(y_seed)-1))
-    else:
-        plt.xlim((-1,len(x_seed)))
-        plt.ylim((-1,len(y_seed)))
-
-    plt.savefig(output_path + "/" + str(random_seed) + ".png", dpi = dpi)
-
-    plt.cla()
-    plt.clf()
-    plt.close('all')
-    plt.close(fig1)
-    gc.collect()
-
-def fill(cmap: str,
-        rng: any,
-        random_seed: int,
-        pattern_path: str,
-        output_path: str,
-        background: str,
-        save: bool):
-    """Flood fills the hitomezashi pattern with colors from a colormap"""
-
-    my_cmap = plt.get_cmap(cmap)
-
-    # Load generated image
-    img = imread(pattern_path + "/" + str(random_seed) + ".png")
-
-    # We use the grayscale image for our flood function to find patches we need to color. Grayscale color scale is from 0 (black) to 1 (white).
-    img_grey = rgb2gray(img[:,:,:3])
-    
-    # We will flood fill all white areas.
-    # Get indices of pixels we need to color.
-    ind = np.where(img_grey > 0.5)
-
-    # Make background transparent if requested
-    if background == "white":
-        mask = []
-        mask.append(flood(img_grey,(ind[0][0],ind[0][0]),tolerance=0.5))
-
-        for item in mask:
-            img_grey[item] = 0
-            img[item] = (255,255,255,255)
-            ind = np.where(img_grey > 0.5)
-
-    # Each loop colors one patch
-    loops = 0
-    while len(ind[0]) > 0:
-        mask = flood(img_grey,(ind[0][0],ind[1][0]),tolerance=0.5)
-        color = my_cmap(rng.random(), bytes=True)[:4]
-        img[mask] = color
-        img_grey[mask] = 0
-        ind = np.where(img_grey > 0.5)
-        loops += 1
-
-    # Save image
-    if save:
-        imsave(output_path + "/" + str(random_seed) + ".png", img)
-
-    return loops
+    parser.add_argument("-n", type=int, default=500, help="Number of patterns to sample per grid size, without --ci-width.")
+    parser.add_argument("-s", type=int, default=0, help="Root seed number of the sweep. 0 will create a psuedorandom seed number.")
+    parser.add_argument("--start", type=int, default=10, help="Smallest number of squares (width/height) in the hitomezashi grid.")
+    parser.add_argument("--stop", type=int, default=150, help="Largest number of squares (width/height) in the hitomezashi grid.")
+    parser.add_argument("--step", type=int, default=2, help="Step between the grid sizes.")
+    parser.add_argument("--x-dist", type=float, default=0.5, help="Parameter of the binomial distribution of the x seed.")
+    parser.add_argument("--y-dist", type=float, default=0.5, help="Parameter of the binomial distribution of the y seed.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to count the patterns with. 0 will use all cores.")
+    parser.add_argument("--batch", type=int, default=4096, help="Largest number of samples counted at once. Batches of large grids are kept to about 4 million pixels.")
+    parser.add_argument("--store", type=str, default="counts.jsonl", help="Store every counted pattern is appended to. An existing store is resumed. A path ending in .bin keeps 16 bytes per pattern, empty keeps only the statistics.")
+    parser.add_argument("--stats", type=str, default="stats.json", help="File the statistics of every grid size are saved to. Without a store, existing statistics are resumed.")
+    parser.add_argument("--bin-width", type=int, default=1, help="Width of the bins of the loop and region histograms.")
+    parser.add_argument("--ci-width", type=float, default=0, help="Sample every grid size until the confidence intervals of its mean loop and region count are narrower than this, instead of taking -n samples. 0 takes -n samples.")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the confidence intervals.")
+    parser.add_argument("--min-n", type=int, default=100, help="Number of patterns to sample per grid size before checking the confidence intervals.")
+    parser.add_argument("--max-n", type=int, default=0, help="Largest number of patterns to sample per grid size with --ci-width. 0 has no limit.")
+    parser.add_argument("--profile", action='store_true', help="Time every stage of every batch, log them to profile.jsonl next to the store and print a summary.")
+    parser.add_argument("--profile-dump", type=str, default=None, help="Run every batch under cProfile and write the merged statistics to this file.")
+    args=parser.parse_args()
+    return args
+
+def batch_size(x: int, limit: int):
+    """Returns how many samples of grid size x are counted at once"""
+    return max(1, min(limit, BATCH_PIXELS // (2 * x + 3)**2))
+
+def count_batch(unit: tuple):
+    """Counts the loops and regions of a batch of samples of the sweep, returns their records and the records of the stages"""
+
+    x, indices, root, x_dist, y_dist = unit
+
+    # Every sample has its own seed, addressed by the grid size and sample number
+    with stage("seeds"):
+        entropies = child_entropies(root, (x,), indices)
+
+        # Generate our seeds for our shape we are going to draw, one row per sample. These determine whether we will draw lines at even or odd coordinates.
+        # Every sample draws from its own generator, so it can be drawn again on its own with square.py -s.
+        x_seeds = np.empty((len(indices), x+1), dtype=np.int64)
+        y_seeds = np.empty((len(indices), x+1), dtype=np.int64)
+        for k, entropy in enumerate(entropies):
+            rng = np.random.default_rng(entropy)
+            x_seeds[k] = rng.binomial(1, x_dist, x+1)
+            y_seeds[k] = rng.binomial(1, y_dist, x+1)
+
+    # Count directly on the lattice, same as drawing the patterns without (loops) and with (regions) border and filling them
+    with stage("count") as record:
+        if (2 * x + 3)**2 <= BATCH_PIXELS:
+            loops, regions = count_loops_regions_batch(x_seeds, y_seeds)
+        else:
+            counts = [count_loops_regions_streaming(x_seed, y_seed) for x_seed, y_seed in zip(x_seeds, y_seeds)]
+            loops, regions = np.array(counts, dtype=np.int64).reshape(-1, 2).T
+        record["regions"] = int(regions.sum())
+
+    records = [{"x": x, "i": i, "seed": str(entropy), "loops": num_loops, "regions": num_regions}
+               for i, entropy, num_loops, num_regions in zip(indices, entropies, loops.tolist(), regions.tolist())]
+    return records, take_records()
+
+def samples_wanted(accumulators: dict, args: any):
+    """Returns how many more samples a grid size needs, from the statistics of its loop and region counts"""
+
+    num = accumulators["loops"]["n"]
+    if args.ci_width == 0:
+        return max(args.n - num, 0)
+    if num < args.min_n:
+        return args.min_n - num
+    if all(interval_width(acc, args.confidence) <= args.ci_width for acc in accumulators.values()):
+        return 0
+
+    # Ask for the estimated number of samples at once, but for at least a quarter more, so there are no long tails of small rounds
+    needed = max(samples_needed(acc, args.ci_width, args.confidence) for acc in accumulators.values())
+    wanted = max(needed - num, num // 4, 1)
+    if args.max_n > 0:
+        wanted = min(wanted, args.max_n - num)
+    return max(wanted, 0)
+
+def next_samples(done: set, cursor: int, num: int):
+    """Returns the next num sample numbers from cursor on that are not counted yet, and where to continue after them"""
+
+    indices = []
+    while len(indices) < num:
+        if cursor not in done:
+            indices.append(cursor)
+        cursor += 1
+    return indices, cursor
 
 def main():
-    s = 0
-    o = "analysis/"
-    width = 3.1
-    height = 3.1
-    padding = 0.04
-    n = 500
-    background = "white"
-
-    # Paremeters of the binomial distribution
-    x_dist = 0.5
-    y_dist = 0.5
-
-    steps = np.arange(10, 152, 2)
-    num_loops = {}
-    for item in steps:
-        num_loops[str(item)] = {}
-
-    if isfile("num_loops.json"):
-        num_loops = load_db("num_loops.json")
-
-    # Count number of loops
-    print("Loops")
-    for x in steps:
-        if len(num_loops[str(x)]) > 0:
-            continue
-        print(x)
-        for i in range(0,n):
-
-            # Initialise seed for RNG
-            if s ==0:
-                seed_seq = np.random.SeedSequence()
-            else:
-                seed_seq = np.random.SeedSequence(s)
-
-            rng = np.random.default_rng(seed_seq)
-
-            #Get cmap
-            cmap = "viridis"
-
-            # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
-            x_seed = rng.binomial(1, x_dist, x+1)
-            y_seed = rng.binomial(1, y_dist, x+1)
-
-            # Draw shape and fill
-            # Output directory is the user specified relative path + the pattern or colored folder + the number of squares in the grid + the name of the colormap + the seeds number
-            pattern_path = o + "/patterns/" + str(x) + "/" + cmap + "/"
-            makedirs(pattern_path, exist_ok=True)
-            draw(x_seed, y_seed, seed_seq.entropy, pattern_path, width, height, padding, 100, False)
-
-            colored_path = o + "/colored/" + str(x) + "/" + cmap + "/"
-            makedirs(colored_path, exist_ok=True)
-            loops = fill(cmap, rng, seed_seq.entropy, pattern_path, colored_path, background, False)
-
-            num_loops[str(x)][str(seed_seq.entropy)] = loops
-
-        save_db(num_loops, "num_loops.json")
-
-
-    num_regions = {}
-    for item in steps:
-        num_regions[str(item)] = {}
-
-    if isfile("num_regions.json"):
-        num_regions = load_db("num_regions.json")
-
-    # Count number of regions
-    print("Regions")
-    for x in steps:
-        if len(num_regions[str(x)]) > 0:
-            continue
-        print(x)
-        for s in num_loops[str(x)]:
-            if len(num_regions[str(x)]) == 0:
-                 save = True
-            else:
-                 save = False
-
-            # Initialise seed for RNG
-            seed_seq = np.random.SeedSequence(int(s))
-
-            rng = np.random.default_rng(seed_seq)
-
-            #Get cmap
-            cmap = "viridis"
-
-            # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
-            x_seed = rng.binomial(1, x_dist, x+1)
-            y_seed = rng.binomial(1, y_dist, x+1)
-
-            # Draw shape and fill
-            # Output directory is the user specified relative path + the pattern or colored folder + the number of squares in the grid + the name of the colormap + the seeds number
-            pattern_path = o + "/patterns/" + str(x) + "/" + cmap + "/"
-            makedirs(pattern_path, exist_ok=True)
-            draw(x_seed, y_seed, seed_seq.entropy, pattern_path, width, height, padding, 100, True)
-
-            colored_path = o + "/colored/" + str(x) + "/" + cmap + "/"
-            makedirs(colored_path, exist_ok=True)
-            loops = fill(cmap, rng, seed_seq.entropy, pattern_path, colored_path, background, save)
-
-            num_regions[str(x)][str(seed_seq.entropy)] = loops
-
-        save_db(num_regions, "num_regions.json")
+    args = parse_args()
+
+    if args.workers == 0:
+        args.workers = cpu_count()
+
+    steps = np.arange(args.start, args.stop + 1, args.step)
+
+    # Resume from the store if there is one, or from the statistics if the sweep keeps no store.
+    # The root seed and the binomial distribution have to stay the same.
+    settings = None
+    samples = {name: np.zeros(0, dtype=np.int64) for name in SAMPLE_DTYPE.names}
+    stored = None
+    end = None
+    if args.store and isfile(args.store):
+        settings, samples, end = read_samples(args.store)
+        print(f"Resuming from {len(samples['x'])} samples in '{args.store}'")
+        source = args.store
+    elif not args.store and isfile(args.stats):
+        stored = read_stats(args.stats)
+        settings = {key: stored["settings"][key] for key in ("root", "x_dist", "y_dist")}
+        if stored["settings"]["bin_width"] != args.bin_width:
+            raise Exception(f"Statistics '{args.stats}' were made with bin_width={stored['settings']['bin_width']}.")
+        print(f"Resuming from the statistics in '{args.stats}'")
+        source = args.stats
+
+    if settings is not None:
+        if settings["x_dist"] != args.x_dist or settings["y_dist"] != args.y_dist:
+            raise Exception(f"'{source}' was made with x_dist={settings['x_dist']} and y_dist={settings['y_dist']}.")
+        if args.s != 0 and args.s != settings["root"]:
+            raise Exception(f"'{source}' was made with root seed {settings['root']}.")
+    else:
+        settings = {"root": args.s, "x_dist": args.x_dist, "y_dist": args.y_dist}
+        if args.s == 0:
+            settings["root"] = np.random.SeedSequence().entropy
+        if args.store:
+            create_store(args.store, settings)
+
+    print(f"Root seed: {settings['root']}")
+    root = np.random.SeedSequence(settings["root"])
+
+    # Statistics of every grid size, from the samples in the store or from the saved statistics.
+    # Samples are counted in order of their sample number, so without a store the first n sample numbers of a grid size are done.
+    stats = {"settings": dict(settings, bin_width=args.bin_width), "sizes": {}}
+    done = {}
+    cursor = {}
+    if stored is not None:
+        stats["sizes"] = stored["sizes"]
+        for x, accumulators in stored["sizes"].items():
+            cursor[x] = accumulators["loops"]["n"]
+    for x in np.unique(samples["x"]).tolist():
+        rows = samples["x"] == x
+        stats["sizes"][x] = {key: new_accumulator(args.bin_width) for key in ("loops", "regions")}
+        for key in ("loops", "regions"):
+            accumulate(stats["sizes"][x][key], samples[key][rows])
+        done[x] = set(samples["i"][rows].tolist())
+    sizes = [int(x) for x in steps]
+    for x in sizes:
+        stats["sizes"].setdefault(x, {key: new_accumulator(args.bin_width) for key in ("loops", "regions")})
+        done.setdefault(x, set())
+        cursor.setdefault(x, 0)
+
+    # Count the samples in rounds, append every sample to the store as soon as it is counted and save the statistics as they grow
+    start = perf_counter()
+    saved = start
+    if end is not None:
+        # Cut off the sample that was being written when the sweep was stopped, so new samples are appended after the last complete one
+        truncate(args.store, end)
+    fd = open_store(args.store) if args.store else None
+    job = count_batch
+    if args.profile_dump is not None:
+        dump_dir = mkdtemp()
+        job = partial(profiled, count_batch, dump_dir)
+    log = None
+    entries = []
+    if args.profile:
+        log = open((dirname(args.store or args.stats) or ".") + "/profile.jsonl", "w")
+    if args.workers != 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+
+    counted = 0
+    while True:
+        # Work units are batches of the next sample numbers of every grid size that needs more samples
+        units = []
+        for x in sizes:
+            indices, cursor[x] = next_samples(done[x], cursor[x], samples_wanted(stats["sizes"][x], args))
+            size = batch_size(x, args.batch)
+            for first in range(0, len(indices), size):
+                units.append((x, indices[first:first + size], root, settings["x_dist"], settings["y_dist"]))
+        if not units:
+            break
+
+        if args.workers == 1:
+            results = map(job, units)
+        else:
+            results = executor.map(job, units)
+
+        for records, stages in results:
+            if fd is not None:
+                append_samples(fd, records, is_compact(args.store))
+            for key in ("loops", "regions"):
+                accumulate(stats["sizes"][records[0]["x"]][key], [record[key] for record in records])
+            if log is not None:
+                entry = {"x": records[0]["x"], "i": records[0]["i"], "samples": len(records), "stages": stages}
+                log_entry(log, entry)
+                entries.append(entry)
+            if (counted + len(records)) // 1000 > counted // 1000:
+                if fd is not None:
+                    fsync(fd)
+                print(f"{counted + len(records)} samples")
+            counted += len(records)
+
+            # Batches come back in order, so the saved statistics always hold the first samples of every grid size
+            if perf_counter() - saved > 10:
+                write_stats(args.stats, stats)
+                saved = perf_counter()
+
+        write_stats(args.stats, stats)
+
+    if args.workers != 1:
+        executor.shutdown()
+    if fd is not None:
+        fsync(fd)
+        close(fd)
+    write_stats(args.stats, stats)
+
+    elapsed = perf_counter() - start
+    print(f"Counted {counted} samples in {elapsed:.2f} s with {args.workers} worker(s) ({60 * counted / max(elapsed, 1e-9):.0f} samples/min)")
+
+    # Mean counts with the half width of their confidence interval
+    print(f"{'x':>8}{'samples':>10}{'loops':>24}{'regions':>24}")
+    for x in sizes:
+        loops = stats["sizes"][x]["loops"]
+        regions = stats["sizes"][x]["regions"]
+        print(f"{x:>8}{loops['n']:>10}"
+              f"{loops['mean']:>14.2f} ± {interval_width(loops, args.confidence) / 2:>7.2f}"
+              f"{regions['mean']:>14.2f} ± {interval_width(regions, args.confidence) / 2:>7.2f}")
+
+    if log is not None:
+        log.close()
+        print_summary(entries)
+    if args.profile_dump is not None:
+        merge_profiles(dump_dir, args.profile_dump)
+        rmtree(dump_dir)
 
 
 if __name__ == "__main__":
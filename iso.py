@@ -1,86 +1,122 @@
 import argparse
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
-from  matplotlib.colors import ListedColormap
 import numpy as np
-from skimage.segmentation import flood
-from skimage.io import imread, imsave
-from skimage.color import rgb2gray
-from metbrewer import met_brew, return_met_palettes
+from colormaps import colormap_names, colormap_lut
+from labeling import white_mask, white_extent, fill_regions, color_regions, region_colors, line_coverage, draw_lines, ink_image
 from os import makedirs
-from skimage.transform import rescale
-
-def draw(
+from functools import partial
+from batch import pattern_seeds, run_batch
+from profiling import stage, take_records
+from os.path import getsize
+from writer import write_png
+from cache import pattern_key, cache_load, cache_store
+from recolor import save_label_map
+from vector import merge_polylines, polyline_collection, polygon_sides, region_outlines, region_collection, save_figure
+
+# matplotlib, skimage and scipy are imported by the functions that use them, so --help and the worker start without them
+
+def stitch_segments(
         x_1_seed: list,
         x_2_seed: list,
-        y_seed: list,
-        random_seed: int,
-        output_path: str,
+        y_seed: list
+        ):
+    """Returns the stitches of an isometric hitomezashi grid, clipped to the triangle, as an (N, 2, 2) array of line segments"""
+
+    x_1_seed = np.asarray(x_1_seed)
+    x_2_seed = np.asarray(x_2_seed)
+    y_seed = np.asarray(y_seed)
+    rows = np.arange(len(y_seed))
+
+    # Horizontal lines at y=i start half a triangle further to the right every row.
+    # Stitches that end past the right side of the triangle are dropped.
+    starts = np.arange(0, len(x_1_seed), 2)
+    x1 = starts[None, :] + rows[:, None] / 2 + y_seed[:, None]
+    y1 = np.broadcast_to(rows[:, None], x1.shape)
+    keep = starts[None, :] + 1 + y_seed[:, None] + rows[:, None] <= len(y_seed)
+    horizontal = np.stack((np.stack((x1, y1), -1), np.stack((x1 + 1, y1), -1)), -2)[keep]
+
+    # Slanted lines going up and to the right from x=i on the base.
+    # Stitch k of a line starts k half triangles to the right and is dropped past the right side of the triangle.
+    steps = np.arange(0, len(y_seed), 2)
+    lines = np.arange(len(x_1_seed))
+    x1 = lines[:, None] + steps[None, :] / 2 + x_1_seed[:, None] * 0.5
+    y1 = steps[None, :] + x_1_seed[:, None]
+    keep = 2 * steps[None, :] + x_1_seed[:, None] + 1 < 2 * (len(x_1_seed) - lines[:, None])
+    slanted_1 = np.stack((np.stack((x1, y1), -1), np.stack((x1 + 0.5, y1 + 1), -1)), -2)[keep]
+
+    # Slanted lines going up and to the left from x=i on the base, dropped past the left side of the triangle
+    lines = np.arange(len(x_2_seed))
+    x1 = lines[:, None] - steps[None, :] / 2 - x_2_seed[:, None] * 0.5
+    y1 = steps[None, :] + x_2_seed[:, None]
+    keep = 2 * steps[None, :] + x_2_seed[:, None] + 1 < 2 * lines[:, None]
+    slanted_2 = np.stack((np.stack((x1, y1), -1), np.stack((x1 - 0.5, y1 + 1), -1)), -2)[keep]
+
+    return np.concatenate((horizontal, slanted_1, slanted_2))
+
+def save_pattern(img: np.ndarray, output_path: str, random_seed: int):
+    """Saves the uncolored pattern"""
+
+    # fill() colors the pattern in place, so the writer gets a copy
+    with stage("save_pattern") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img.copy(), record)
+
+def frame_segments(x_len: int, y_len: int):
+    """Returns the border frame of an isometric hitomezashi grid as line segments"""
+
+    return np.array([
+        ((0,0), (x_len,0)),
+        ((0,0), (x_len/2,y_len)),
+        ((x_len/2,y_len), (x_len,0))
+        ])
+
+def pattern_figure(
+        ln_coll: any,
+        x_len: int,
+        y_len: int,
         width: float,
         height: float,
-        dpi: int,
-        downscale: int
+        dpi: int
         ):
+    """Returns the figure and axes of an isometric hitomezashi pattern with the collection of its lines drawn in"""
+
+    import matplotlib.pyplot as plt
 
     # Initialise figure. We disable most plot elements.
-    # If we downscale, we enlarge the pattern figure by the downscale factor
     one_pixel = 1 / dpi # inch per pixel
-    fig1 = plt.figure(figsize=(width * downscale, height * downscale))
+    fig1 = plt.figure(figsize=(width, height), dpi=dpi)
     ax1 = fig1.add_axes([0,0,1,1], frameon=False)
 
     fig1.patch.set_visible(True)
     ax1.axis('off')
     fig1.patch.set_facecolor('white')
 
-    # Will contain our lines we need to draw
-    lines = []
-
-    # Generate horizontal lines
-    x_offset = -0.5
-    for i in range(0,len(y_seed)):
-        x_offset = x_offset + 0.5
-        seed = y_seed[i]
-        for j in range(0,len(x_1_seed), 2):
-            # Prevent drawing outside of our triangle grid
-            if (j + x_offset + 1 + seed) >  len(y_seed) - (i/2):
-                break
-            y1 = i
-            y2 = i
-            x1 = j + x_offset + seed
-            x2 = j + x_offset + 1 + seed
-            lines.append(((x1,y1), (x2,y2)))
-
-    # Generate slanted lines
-    for i in range(0,len(x_1_seed)):
-        seed = x_1_seed[i]
-        for j in range(0,len(y_seed), 2):
-            # Prevent drawing outside of our triangle grid
-            if (j + seed + 1) >= (len(x_1_seed) - i)*2:
-                break
-            y1 = j + seed
-            y2 = j + seed + 1
-            x1 = i + seed * 0.5
-            x2 = i + seed * 0.5 + 0.5
-            lines.append(((x1,y1), (x2,y2)))
-            i = i + 1
-
-    for i in range(0,len(x_2_seed)):
-        seed = x_2_seed[i]
-        for j in range(0,len(y_seed), 2):
-            # Prevent drawing outside of our triangle grid
-            if (j + seed + 1) >= i*2:
-                break
-            y1 = j + seed
-            y2 = j + seed + 1
-            x1 = i - seed * 0.5
-            x2 = i - seed * 0.5 - 0.5
-            lines.append(((x1,y1), (x2,y2)))
-            i = i - 1
+    # Draw our lines
+    ax1.add_collection(ln_coll)
+
+    plt.xlim((-one_pixel,x_len))
+    plt.ylim((-one_pixel,y_len))
+
+    return fig1, ax1
+
+def draw(
+        x_1_seed: list,
+        x_2_seed: list,
+        y_seed: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        downscale: int
+        ):
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    # Generate horizontal and slanted lines as one (N, 2, 2) array of segments
+    with stage("segments"):
+        lines = stitch_segments(x_1_seed, x_2_seed, y_seed)
 
     # Generate border frame
-    lines.append(((0,0), (len(x_1_seed),0)))
-    lines.append(((0,0), (len(x_1_seed)/2,len(y_seed))))
-    lines.append(((len(x_1_seed)/2,len(y_seed)), (len(x_1_seed),0)))
+    lines = np.concatenate((lines, frame_segments(len(x_1_seed), len(y_seed))))
 
     # Draw our lines
     ln_coll = LineCollection(lines,
@@ -89,63 +125,332 @@ def draw(
                         zorder=8,
                         antialiased=False
                         )
-    ax1.add_collection(ln_coll)
 
-    plt.xlim((-one_pixel,len(x_1_seed)))
-    plt.ylim((-one_pixel,len(y_seed)))
+    # If we downscale, we enlarge the pattern figure by the downscale factor
+    fig1, _ = pattern_figure(ln_coll, len(x_1_seed), len(y_seed), width * downscale, height * downscale, dpi)
+
+    # Render the figure to an RGBA array, fill() colors this array directly instead of reading the pattern back from disk
+    with stage("render"):
+        fig1.canvas.draw()
+        img = np.array(fig1.canvas.buffer_rgba())
+    plt.close(fig1)
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(img, output_path, random_seed)
 
-    plt.savefig(output_path + "/" + str(random_seed) + ".png", dpi = dpi)
+    return img
+
+def draw_vector(
+        x_1_seed: list,
+        x_2_seed: list,
+        y_seed: list,
+        random_seed: int,
+        cmap: str,
+        background: str,
+        rng: any,
+        pattern_path: str,
+        colored_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        downscale: int,
+        file_format: str
+        ):
+    """Generates an isometric hitomezashi pattern and its colored regions as vector graphics (svg or pdf)
+
+    The stitches are merged into polylines and every region is one filled path, traced on the triangles of the grid.
+    The figure has the size of the downscaled image, with the lines as thin as they end up after downscaling.
+    """
+
+    import matplotlib.pyplot as plt
+
+    # All lines are one path
+    size = len(y_seed)
+    with stage("segments"):
+        lines = merge_polylines(np.concatenate((stitch_segments(x_1_seed, x_2_seed, y_seed), frame_segments(len(x_1_seed), size))))
+    fig1, ax1 = pattern_figure(polyline_collection(lines, 0.5 / downscale), len(x_1_seed), size, width, height, dpi)
+
+    # Saving the uncolored pattern is optional
+    if pattern_path is not None:
+        with stage("save_pattern") as record:
+            record["bytes"] = save_figure(fig1, pattern_path + "/" + str(random_seed) + "." + file_format, file_format)
+
+    with stage("fill") as record:
+        # Point k of row r is at (k + r/2, r), point r * (size + 1) + k
+        r, k = np.divmod(np.arange((size + 1) ** 2), size + 1)
+        points = np.stack((k + r / 2, r), -1).astype(float)
+
+        # Triangle (r, 2a) points up and (r, 2a+1) points down, the same nodes as in triangle_regions()
+        r, a = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+        up = a <= size - 1 - r
+        down = a <= size - 2 - r
+        corner = r * (size + 1) + a
+        node = r * (2 * size - 1) + 2 * a
+        ups = np.stack((corner, corner + 1, corner + size + 1), -1)[up]
+        downs = np.stack((corner + 1, corner + size + 2, corner + size + 1), -1)[down]
+
+        # The areas left and right of the triangle reach to the edges of the figure
+        one_pixel = 1 / dpi
+        apex = size * (size + 1)
+        points = np.concatenate((points, [(-one_pixel, size), (-one_pixel, 0), (len(x_1_seed), size)]))
+        left = np.array([[0, apex, apex + size + 1, apex + size + 2]])
+        right = np.array([[size, apex + size + 3, apex]])
+        outside = size * (2 * size - 1)
+
+        labels = triangle_regions(*stitch_walls(x_1_seed, x_2_seed, y_seed))
+        sides = [polygon_sides(ups, node[up]), polygon_sides(downs, node[down] + 1),
+                 polygon_sides(left, [outside]), polygon_sides(right, [outside + 1])]
+
+        # Make background transparent if requested
+        background_points = []
+        if background == "transparent":
+            background_points.append((outside,))
+            background_points.append((outside + 1,))
+        colors, _, record["regions"] = region_colors(labels, int(labels.max()), colormap_lut(cmap), rng, background_points, (0,0,0,0))
+
+        fig1.patch.set_facecolor("none")
+        ax1.add_collection(region_collection(region_outlines(points, sides, labels), colors))
+
+    with stage("save") as record:
+        record["bytes"] = save_figure(fig1, colored_path + "/" + str(random_seed) + "." + file_format, file_format)
+    plt.close(fig1)
 
 def fill(cmap: str,
         rng: any,
         random_seed: int,
         background: str,
         downscale: int,
-        pattern_path: str,
-        output_path: str):
+        img: np.ndarray,
+        output_path: str,
+        labels_path: str = None):
     """Flood fills the hitomezashi pattern with colors from a colormap"""
 
-    my_cmap = plt.get_cmap(cmap)
+    from skimage.transform import rescale
 
-    # Load generated image
-    img = imread(pattern_path + "/" + str(random_seed) + ".png")
+    lut = colormap_lut(cmap)
 
-    # We use the grayscale image for our flood function to find patches we need to color. Grayscale color scale is from 0 (black) to 1 (white).
-    img_grey = rgb2gray(img[:,:,:3])
-    
-    # We will flood fill all white areas.
-    # Get indices of pixels we need to color.
-    ind = np.where(img_grey > 0.5)
+    # We threshold the grayscale image to find the patches we need to color, one block of rows at a time so there is no full size float copy.
+    with stage("threshold"):
+        white = white_mask(img, 0.5)
 
     # Make background transparent if requested
+    background_points = []
     if background == "transparent":
-        mask = []
-        mask.append(flood(img_grey,(ind[0][0],ind[0][0]),tolerance=0))
-        mask.append(flood(img_grey,(ind[-1][0],ind[0][-1]),tolerance=0))
-
-        for item in mask:
-            img_grey[item] = 0
-            img[item] = (0,0,0,0)
-            ind = np.where(img_grey > 0.5)
-
-    # Each loop colors one patch
-    while len(ind[0]) > 0:
-        mask = flood(img_grey,(ind[0][0],ind[1][0]),tolerance=0)
-        color = my_cmap(rng.random(), bytes=True)[:4]
-        img[mask] = color
-        img_grey[mask] = 0
-        ind = np.where(img_grey > 0.5)
+        (first_row, first_column), (last_row, _) = white_extent(white)
+        background_points.append((first_row,first_row))
+        background_points.append((first_column,last_row))
+
+    # Each white area is one patch, colored in place. The label map is only kept if it is saved.
+    label_map = None if labels_path is None else {}
+    with stage("fill") as record:
+        record["regions"] = fill_regions(img, white, lut, rng, background_points, (0,0,0,0), label_map)
+    if labels_path is not None:
+        with stage("save_labels") as record:
+            path = labels_path + "/" + str(random_seed) + ".npz"
+            save_label_map(path, label_map, downscale)
+            record["bytes"] = getsize(path)
 
     # Downscale the image
     if downscale != 1:
-        img = rescale(img, 0.5, channel_axis=-1, anti_aliasing=True)
-        img *= 255
-        img = img.astype(np.uint8)
+        with stage("rescale"):
+            img = rescale(img, 0.5, channel_axis=-1, anti_aliasing=True)
+            img *= 255
+            img = img.astype(np.uint8)
+
+    # Save image, it is compressed in the background while the next pattern is drawn
+    with stage("save") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img, record)
+
+def stitch_walls(
+        x_1_seed: list,
+        x_2_seed: list,
+        y_seed: list
+        ):
+    """Returns which unit edges of an isometric hitomezashi grid, border frame included, are covered by a stitch"""
+
+    x_1_seed = np.asarray(x_1_seed)
+    x_2_seed = np.asarray(x_2_seed)
+    y_seed = np.asarray(y_seed)
+    size = len(y_seed)
+    units = np.arange(size)
+
+    # h_walls[i, a] is True if the horizontal line at y=i is stitched from x=a+i/2 to x=a+i/2+1, the base is part of the frame
+    h_walls = ((units[None, :] - y_seed[:, None]) % 2 == 0) & (units[None, :] + units[:, None] < size)
+    h_walls[0] = True
+
+    # u_walls[k, m] is True if the line going up and to the right from x=k is stitched from y=m to y=m+1, the left side is part of the frame
+    u_walls = ((units[None, :] - x_1_seed[:, None]) % 2 == 0) & (units[None, :] + units[:, None] < size)
+    u_walls[0] = True
+
+    # v_walls[k, m] is True if the line going up and to the left from x=k is stitched from y=m to y=m+1, the right side is part of the frame
+    v_walls = np.ones((size + 1, size), dtype=bool)
+    v_walls[:size] = ((units[None, :] - x_2_seed[:, None]) % 2 == 0) & (units[None, :] < units[:, None])
+
+    return h_walls, u_walls, v_walls
+
+def triangle_regions(
+        h_walls: np.ndarray,
+        u_walls: np.ndarray,
+        v_walls: np.ndarray
+        ):
+    """Labels the regions of an isometric hitomezashi grid on the lattice, returns the region label of every triangle
+
+    Triangle (r, c) is the c-th triangle from the left in row r, even columns point up and odd columns point down.
+    The two areas outside the triangle, left and right of it, are the last two nodes.
+    """
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    size = h_walls.shape[0]
+    num_columns = 2 * size - 1
+    triangle = np.arange(size * num_columns).reshape(size, num_columns)
+
+    # Triangle (r, 2a) points up, (r, 2a+1) points down, rows get shorter towards the top
+    r, a = np.meshgrid(np.arange(size), np.arange(size - 1), indexing="ij")
+    valid = a <= size - 2 - r
+    r = r[valid]
+    a = a[valid]
+
+    # Neighbours in the same row are separated by the slanted lines, a down triangle and the up triangle above it by a horizontal line
+    open_v = ~v_walls[a + r + 1, r]
+    open_u = ~u_walls[a + 1, r]
+    above = r < size - 1
+    open_h = ~h_walls[r[above] + 1, a[above]]
+    source = [triangle[r, 2*a][open_v], triangle[r, 2*a + 1][open_u], triangle[r[above], 2*a[above] + 1][open_h]]
+    target = [triangle[r, 2*a + 1][open_v], triangle[r, 2*a + 2][open_u], triangle[r[above] + 1, 2*a[above]][open_h]]
+
+    source = np.concatenate(source)
+    target = np.concatenate(target)
+    num_nodes = size * num_columns + 2
+    graph = coo_matrix((np.ones(len(source), dtype=np.int8), (source, target)), shape=(num_nodes, num_nodes))
+    _, regions = connected_components(graph, directed=False)
+
+    # Number the regions from 1 in close to the order labeling the rendered image finds them, regions whose tops are within a pixel of each other
+    # can come in another order, so the colors of a seed differ from the agg renderer's: the areas outside the triangle first,
+    # then from the top row down, in every row the triangles pointing down before the ones pointing up, from left to right
+    rows, columns = np.divmod(np.arange(size * num_columns), num_columns)
+    scan = np.flatnonzero(columns <= 2 * (size - 1 - rows))
+    scan = scan[np.lexsort((columns[scan], columns[scan] % 2 == 0, -rows[scan]))]
+    scan = np.concatenate(([num_nodes - 2, num_nodes - 1], scan))
+    found, first = np.unique(regions[scan], return_index=True)
+    labels = np.zeros(regions.max() + 1, dtype=np.int64)
+    labels[found[np.argsort(first)]] = np.arange(1, len(found) + 1)
+    return labels[regions]
+
+def rasterize(
+        x_1_seed: list,
+        x_2_seed: list,
+        y_seed: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        line_width: float
+        ):
+    """Renders an isometric hitomezashi pattern at its final size without matplotlib
+
+    Returns the region label of every pixel and the anti-aliased line coverage of every pixel.
+    """
 
-    # Save image
-    imsave(output_path + "/" + str(random_seed) + ".png", img)
+    size = len(y_seed)
+    h_walls, u_walls, v_walls = stitch_walls(x_1_seed, x_2_seed, y_seed)
 
-def parse_args():
+    # Same axis limits as draw()
+    one_pixel = 1 / dpi # inch per pixel
+    img_width = round(width * dpi) # in pixels
+    img_height = round(height * dpi) # in pixels
+    x_lim = (-one_pixel, len(x_1_seed))
+    y_lim = (-one_pixel, size)
+    x_scale = img_width / (x_lim[1] - x_lim[0]) # pixels per unit
+    y_scale = img_height / (y_lim[1] - y_lim[0]) # pixels per unit
+
+    # Centre of every pixel, rows are counted from the top of the image
+    x = x_lim[0] + (np.arange(img_width) + 0.5) / x_scale
+    y = y_lim[1] - (np.arange(img_height) + 0.5) / y_scale
+    x, y = np.meshgrid(x, y)
+
+    # Along the slanted lines x - y/2 (up and to the right) or x + y/2 (up and to the left) is constant
+    u = x - y / 2
+    v = x + y / 2
+
+    # Find the triangle every pixel falls in and look up its region
+    row = np.floor(y).astype(np.int64)
+    column = 2 * np.floor(u).astype(np.int64) + (np.floor(v).astype(np.int64) - np.floor(u).astype(np.int64) - row)
+    inside = (y >= 0) & (y < size) & (u >= 0) & (v < len(x_1_seed))
+    outside = np.where(x < len(x_1_seed) / 2, size * (2 * size - 1), size * (2 * size - 1) + 1)
+    nodes = np.where(inside, row * (2 * size - 1) + column, outside)
+    labels = triangle_regions(h_walls, u_walls, v_walls)[nodes]
+
+    """
+    Lines are anti-aliased by how much of a pixel they cover across their width.
+    For every family of lines only the nearest line can cover the pixel, and only if its unit edge at the pixel is stitched.
+    """
+    # The slanted lines are not at 45 degrees when the figure is not square
+    slant = x_scale * y_scale / np.hypot(y_scale, x_scale / 2)
+
+    i = np.clip(np.round(y), 0, size - 1).astype(np.int64)
+    a = np.floor(x - i / 2).astype(np.int64)
+    stitched = h_walls[i, np.clip(a, 0, size - 1)] & (a >= 0) & (a < size)
+    ink = 1 - line_coverage(np.abs(y - i) * y_scale, line_width) * stitched
+
+    m = np.clip(row, 0, size - 1)
+    k = np.clip(np.round(u), 0, size - 1).astype(np.int64)
+    stitched = u_walls[k, m] & (row >= 0) & (row < size)
+    ink *= 1 - line_coverage(np.abs(u - k) * slant, line_width) * stitched
+
+    k = np.clip(np.round(v), 0, size).astype(np.int64)
+    stitched = v_walls[k, m] & (row >= 0) & (row < size)
+    ink *= 1 - line_coverage(np.abs(v - k) * slant, line_width) * stitched
+    ink = 1 - ink
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(ink_image(ink), output_path, random_seed)
+
+    return labels, ink
+
+def fill_rasterized(cmap: str,
+        rng: any,
+        random_seed: int,
+        background: str,
+        labels: np.ndarray,
+        ink: np.ndarray,
+        output_path: str,
+        labels_path: str = None):
+    """Colors the regions of a rasterized hitomezashi pattern with colors from a colormap and draws the lines over them"""
+
+    lut = colormap_lut(cmap)
+    img = np.zeros(labels.shape + (4,), dtype=np.uint8)
+
+    # The top corners of the image are the two areas outside the triangle
+    background_points = []
+    if background == "transparent":
+        background_points.append((0,0))
+        background_points.append((0,labels.shape[1]-1))
+
+    # Each label is one patch. The label map is only kept if it is saved, the lines are drawn from the ink.
+    label_map = None if labels_path is None else {}
+    with stage("fill") as record:
+        record["regions"] = color_regions(img, labels, int(labels.max()), lut, rng, background_points, (0,0,0,0), label_map)
+    if labels_path is not None:
+        label_map["ink"] = ink
+        with stage("save_labels") as record:
+            path = labels_path + "/" + str(random_seed) + ".npz"
+            save_label_map(path, label_map)
+            record["bytes"] = getsize(path)
+
+    # Draw the black lines over the colors
+    with stage("lines"):
+        draw_lines(img, ink)
+
+    # Save image, it is compressed in the background while the next pattern is drawn
+    with stage("save") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img, record)
+
+def parse_args(argv: list = None):
     parser=argparse.ArgumentParser(
         description="Plots hitomezashi patterns in a iso grid. ",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -159,91 +464,110 @@ def parse_args():
     parser.add_argument("--height", type=float, default=10, help="Figure height in inches.")
     parser.add_argument("--background", type=str, default="transparent", help="'transparent' or 'colored' background.")
     parser.add_argument("--downscale", type=int, default=2, help="Factor by which to downscale the final image. To disable downscale, enter a value of 1.")
-    args=parser.parse_args()
+    parser.add_argument("--renderer", type=str, default="agg", choices=["agg", "numpy"], help="'agg' draws the pattern with matplotlib at the downscale factor and rescales it, 'numpy' renders anti-aliased lines at the final size (much faster).")
+    parser.add_argument("--format", type=str, default="png", choices=["png", "svg", "pdf"], help="File format of the images. 'svg' and 'pdf' write the lines as polylines and the regions as filled paths, without rendering, caching or label maps.")
+    parser.add_argument("--no-pattern", action='store_true', help="Do not save the uncolored pattern, only the colored image.")
+    parser.add_argument("--save-labels", action='store_true', help="Save the region label map of every pattern, so it can be colored again with recolor.py.")
+    parser.add_argument("--cache", type=str, default=None, help="Directory to cache the uncolored patterns in, a pattern that is in the cache is not drawn again. No cache if not given.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Size of the cache in MB, the patterns used least recently are removed first.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to generate the patterns with. 0 will use all cores.")
+    parser.add_argument("--writers", type=int, default=1, help="Number of background threads per process that compress and write the PNG images while the next pattern is drawn. 0 writes them right away.")
+    parser.add_argument("--compression", type=int, default=6, choices=range(10), metavar="{0..9}", help="PNG compression level, from 0 (fastest, largest files) to 9 (slowest, smallest files).")
+    parser.add_argument("--profile", action='store_true', help="Time every stage of every pattern, log them to profile.jsonl in the output path and print a summary.")
+    parser.add_argument("--profile-dump", type=str, default=None, help="Run every pattern under cProfile and write the merged statistics to this file.")
+    args=parser.parse_args(argv)
     return args
 
-def main():
-    args = parse_args()
+def generate(args: any, cmaps_list: list, seed_seq: any):
+    """Draws and fills one hitomezashi pattern"""
 
     # Paremeters of the binomial distribution
     x_1_dist = 0.5
     x_2_dist = 0.5
     y_dist = 0.5
 
-    # The matplotlib colormaps
-    cmaps = {
-        "uniform": ['viridis', 'plasma', 'inferno', 'magma', 'cividis'],
-        "sequential": ['Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
-                      'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
-                      'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn'],
-        "sequential2": ['binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
-                      'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
-                      'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper'],
-        "diverging": ['PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu', 'RdYlBu',
-                      'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic',
-                      'berlin', 'managua', 'vanimo'],
-        "cyclic": ['twilight', 'twilight_shifted', 'hsv'],
-        "qualitative": ['Pastel1', 'Pastel2', 'Paired', 'Accent', 'Dark2',
-                      'Set1', 'Set2', 'Set3', 'tab10', 'tab20', 'tab20b',
-                      'tab20c'],
-        "misc": ['flag', 'prism', 'ocean', 'gist_earth', 'terrain',
-                      'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
-                      'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
-                      'turbo', 'nipy_spectral', 'gist_ncar']
-    }
-
-    # Generate n number of hitomezashi plots
-    for i in range(0,args.n):
-
-        # Initialise seed for RNG
-        if args.s ==0:
-            seed_seq = np.random.SeedSequence()
-        else:
-            seed_seq = np.random.SeedSequence(args.s)
-
-        rng = np.random.default_rng(seed_seq)
-
-        #Get cmap
-        met_palettes = return_met_palettes()
-        cmaps_list = []
-        if args.c == "all":
-            for cmap_name in cmaps:
-                for item in cmaps[cmap_name]:
-                    cmaps_list.append(item)
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        elif args.c == "metbrewer":
-            cmaps_list = []
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        else:
-             cmaps_list.append(args.c)
-
-        cmap_ind = rng.integers(0, len(cmaps_list))
-        cmap = cmaps_list[cmap_ind]
+    rng = np.random.default_rng(seed_seq)
 
-        if cmap in met_palettes:
-            colors = met_brew(cmap)
-            cmap_object = ListedColormap(colors)
-        else:
-            cmap_object = cmap
+    #Get cmap
+    cmap_ind = rng.integers(0, len(cmaps_list))
+    cmap = cmaps_list[cmap_ind]
 
-        # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    with stage("seeds"):
         x_1_seed = rng.binomial(1, x_1_dist, args.x)
         x_2_seed = rng.binomial(1, x_2_dist, args.x)
         y_seed = rng.binomial(1, y_dist, args.x)
 
-        # Draw shape and fill
-        # Output directory is the user specified relative path + the pattern or colored folder + the number of triangles in the grid + the name of the colormap + the seeds number
+    # Draw shape and fill
+    # Output directory is the user specified relative path + the pattern or colored folder + the number of triangles in the grid + the name of the colormap + the seeds number
+    pattern_path = None
+    if not args.no_pattern:
         pattern_path = args.o + "/patterns/" + str(args.x) + "/" + cmap + "/"
         makedirs(pattern_path, exist_ok=True)
-        draw(x_1_seed, x_2_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, 100, args.downscale)
+    colored_path = args.o + "/colored/" + str(args.x) + "/" + cmap + "/"
+    makedirs(colored_path, exist_ok=True)
+
+    # Vector graphics are not rendered, so there is nothing to cache or label
+    if args.format != "png":
+        with stage("draw"):
+            draw_vector(x_1_seed, x_2_seed, y_seed, seed_seq.entropy, cmap, args.background, rng, pattern_path, colored_path,
+                        args.width, args.height, 100, args.downscale, args.format)
+        return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+    # Label maps do not depend on the colormap, they are saved once per pattern
+    labels_path = None
+    if args.save_labels:
+        labels_path = args.o + "/labels/" + str(args.x) + "/"
+        makedirs(labels_path, exist_ok=True)
+
+    # The uncolored pattern does not depend on the colormap or the background, so it can come from the cache
+    cached = None
+    if args.cache is not None:
+        key = pattern_key("iso", [x_1_seed, x_2_seed, y_seed], {"width": args.width, "height": args.height, "dpi": 100, "downscale": args.downscale, "renderer": args.renderer})
+        with stage("cache_load"):
+            cached = cache_load(args.cache, key)
+
+    if args.renderer == "numpy":
+        if cached is not None:
+            labels, ink = cached["labels"], cached["ink"]
+            if pattern_path is not None:
+                save_pattern(ink_image(ink), pattern_path, seed_seq.entropy)
+        else:
+            # About as much ink as the aliased lines of draw() after downscaling, the slanted ones are close to two pixels wide there
+            with stage("rasterize"):
+                labels, ink = rasterize(x_1_seed, x_2_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, 100, 1.6 / args.downscale)
+            if args.cache is not None:
+                with stage("cache_store") as record:
+                    record["bytes"] = cache_store(args.cache, key, {"labels": labels, "ink": ink}, args.cache_size * 2**20)
+        fill_rasterized(cmap, rng, seed_seq.entropy, args.background, labels, ink, colored_path, labels_path)
+    else:
+        if cached is not None:
+            img = cached["img"]
+            if pattern_path is not None:
+                save_pattern(img, pattern_path, seed_seq.entropy)
+        else:
+            with stage("draw"):
+                img = draw(x_1_seed, x_2_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, 100, args.downscale)
+            if args.cache is not None:
+                with stage("cache_store") as record:
+                    record["bytes"] = cache_store(args.cache, key, {"img": img}, args.cache_size * 2**20)
+        fill(cmap, rng, seed_seq.entropy, args.background, args.downscale, img, colored_path, labels_path)
+
+    return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+def main():
+    args = parse_args()
 
-        colored_path = args.o + "/colored/" + str(args.x) + "/" + cmap + "/"
-        makedirs(colored_path, exist_ok=True)
-        fill(cmap_object, rng, seed_seq.entropy, args.background, args.downscale, pattern_path, colored_path)
+    # Colormaps we can draw from
+    cmaps_list = colormap_names(args.c)
 
-        plt.close()
+    # Generate n number of hitomezashi plots, spread over the worker processes
+    seeds = pattern_seeds(args.s, args.n)
+    profile_log = None
+    if args.profile:
+        makedirs(args.o, exist_ok=True)
+        profile_log = args.o + "/profile.jsonl"
+    run_batch(partial(generate, args, cmaps_list), seeds, args.workers, profile_log, args.profile_dump, args.writers, args.compression)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import numpy as np
+from colormaps import lut_colors
+
+# The flood function of skimage treats all adjacent pixels (including diagonals) as neighbours.
+# We label with the same footprint so that every label covers exactly the pixels of one flood fill.
+FOOTPRINT = np.ones((3, 3), dtype=bool)
+
+# Number of pixels converted at once, so temporary arrays stay small for poster size images
+BLOCK_PIXELS = 1 << 20
+
+def row_blocks(num_rows: int, row_size: int):
+    """Splits the rows of an image into blocks of about BLOCK_PIXELS pixels"""
+
+    step = max(1, BLOCK_PIXELS // max(row_size, 1))
+    return [slice(start, start + step) for start in range(0, num_rows, step)]
+
+def white_mask(img: np.ndarray, threshold: float = 0.5):
+    """Returns a boolean mask of the white areas of an RGBA pattern, converting it to grayscale one block of rows at a time"""
+
+    from skimage.color import rgb2gray
+
+    # Grayscale color scale is from 0 (black) to 1 (white)
+    mask = np.empty(img.shape[:2], dtype=bool)
+    for rows in row_blocks(img.shape[0], img.shape[1]):
+        mask[rows] = rgb2gray(img[rows, :, :3]) > threshold
+    return mask
+
+def white_extent(mask: np.ndarray):
+    """Returns the (row, column) of the first and the last white pixel, the ones np.where(mask) would find first and last"""
+
+    flat = mask.ravel()
+    first = int(np.argmax(flat))
+    last = flat.size - 1 - int(np.argmax(flat[::-1]))
+    return divmod(first, mask.shape[1]), divmod(last, mask.shape[1])
+
+def region_colors(labels: np.ndarray,
+        num_labels: int,
+        lut: np.ndarray,
+        rng: any,
+        background_points: list = (),
+        background_color: tuple = (0,0,0,0)):
+    """Returns the RGBA color of every label, the random value its color was looked up with (NaN if it has none) and the number of colored regions
+
+    Label 0 (the lines) gets no color.
+    """
+
+    # Regions containing one of the background points get the background color and no random color
+    background_labels = []
+    for point in background_points:
+        region = labels[point]
+        if region > 0 and region not in background_labels:
+            background_labels.append(region)
+
+    is_colored = np.ones(num_labels + 1, dtype=bool)
+    is_colored[0] = False
+    is_colored[background_labels] = False
+    num_colored = int(np.count_nonzero(is_colored))
+
+    # One color per region, drawn in label order with a single lookup
+    values = np.full(num_labels + 1, np.nan)
+    values[is_colored] = rng.random(num_colored)
+    colors = np.zeros((num_labels + 1, 4), dtype=np.uint8)
+    colors[background_labels] = background_color
+    colors[is_colored] = lut_colors(lut, values[is_colored])
+
+    return colors, values, num_colored
+
+def color_regions(img: np.ndarray,
+        labels: np.ndarray,
+        num_labels: int,
+        lut: np.ndarray,
+        rng: any,
+        background_points: list = (),
+        background_color: tuple = (0,0,0,0),
+        label_map: dict = None):
+    """Colors every labeled region with a random color from a colormap lookup table, returns the number of colored regions
+
+    A label_map dict gets the labels and the random value of every region, so the image can be recolored later.
+    """
+
+    colors, values, num_colored = region_colors(labels, num_labels, lut, rng, background_points, background_color)
+    if label_map is not None:
+        label_map.update(labels=labels.astype(np.uint32), values=values, background=np.array(background_color, dtype=np.uint8))
+
+    # Paint all regions at once, leaving the lines (label 0) untouched
+    mask = labels > 0
+    img[mask] = colors[labels[mask]]
+
+    return num_colored
+
+def fill_regions(img: np.ndarray,
+        mask: np.ndarray,
+        lut: np.ndarray,
+        rng: any,
+        background_points: list = (),
+        background_color: tuple = (0,0,0,0),
+        label_map: dict = None):
+    """Colors every white region of an RGBA pattern in place with a random color from a colormap lookup table, returns the number of colored regions
+
+    The regions are labeled in a single connected-component pass, straight into the image itself.
+    Next to the image only the mask and the pixels of the lines are kept in memory.
+    A label_map dict gets a copy of the labels, the random value of every region and the pixels of the lines, so the image can be recolored later.
+    """
+
+    from scipy.ndimage import label
+
+    # Every RGBA pixel is one 32 bit number
+    pixels = img.view(np.uint32).reshape(mask.shape)
+
+    # Put the lines aside, they are overwritten by the labels
+    np.logical_not(mask, out=mask)
+    lines = pixels[mask]
+    np.logical_not(mask, out=mask)
+
+    # Labels are numbered in the order in which their top-left pixel is found when scanning the image row by row.
+    # This is the same order in which the old flood fill loop visited the regions, so the RNG draws stay the same.
+    num_labels = label(mask, structure=FOOTPRINT, output=pixels)
+    colors, values, num_colored = region_colors(pixels, num_labels, lut, rng, background_points, background_color)
+    if label_map is not None:
+        label_map.update(labels=pixels.copy(), values=values, background=np.array(background_color, dtype=np.uint8), lines=lines)
+
+    # Replace the labels by their colors and put the lines back
+    colors = colors.view(np.uint32).ravel()
+    for rows in row_blocks(pixels.shape[0], pixels.shape[1]):
+        pixels[rows] = colors[pixels[rows]]
+    np.logical_not(mask, out=mask)
+    pixels[mask] = lines
+    np.logical_not(mask, out=mask)
+
+    return num_colored
+
+def number_by_appearance(regions: np.ndarray):
+    """Numbers the regions of a flat array from 1 in the order they first appear in it"""
+
+    _, first, regions = np.unique(regions, return_index=True, return_inverse=True)
+    order = np.empty(len(first), dtype=np.int64)
+    order[np.argsort(first)] = np.arange(1, len(first) + 1)
+    return order[regions]
+
+def line_coverage(distance: np.ndarray, line_width: float):
+    """Returns how much of a pixel a line covers, from the distance between the pixel centre and the line in pixels"""
+
+    # The overlap of the line and the pixel across the width of the line
+    return np.clip(np.minimum(distance + line_width / 2, 0.5) - np.maximum(distance - line_width / 2, -0.5), 0, 1)
+
+def draw_lines(img: np.ndarray, ink: np.ndarray):
+    """Draws black lines over a colored image, ink is the fraction of every pixel covered by the lines"""
+
+    alpha = img[:,:,3] / 255
+    img_alpha = ink + (1 - ink) * alpha
+    color = img[:,:,:3] * ((1 - ink) * alpha / np.maximum(img_alpha, 1e-12))[:, :, None]
+    img[:,:,:3] = np.round(color)
+    img[:,:,3] = np.round(255 * img_alpha)
+
+def ink_image(ink: np.ndarray):
+    """Returns the uncolored RGBA pattern of a rasterized pattern, black lines on white"""
+
+    img = np.full(ink.shape + (4,), 255, dtype=np.uint8)
+    img[:, :, :3] = np.round(255 * (1 - ink))[:, :, None]
+    return img
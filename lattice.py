@@ -0,0 +1,219 @@
+import numpy as np
+
+def stitch_walls(x_seed: list, y_seed: list):
+    """Returns which unit edges of a square hitomezashi grid are covered by a stitch"""
+
+    x_seed = np.asarray(x_seed)
+    y_seed = np.asarray(y_seed)
+
+    # The horizontal line at y=i uses x_seed[i] and the vertical line at x=i uses y_seed[i], like in draw().
+    # A stitch covers the unit edge starting at j when j - seed is even.
+    cols = np.arange(len(y_seed) - 1)
+    rows = np.arange(len(x_seed) - 1)
+
+    # h_walls[i, c] is True if the edge from (c,i) to (c+1,i) is stitched
+    h_walls = (cols[None, :] + x_seed[:, None]) % 2 == 0
+    # v_walls[i, r] is True if the edge from (i,r) to (i,r+1) is stitched
+    v_walls = (rows[None, :] + y_seed[:, None]) % 2 == 0
+
+    return h_walls, v_walls
+
+def stitch_segments(x_seed: list, y_seed: list):
+    """Returns the stitches of a square hitomezashi grid as an (N, 2, 2) array of line segments"""
+
+    x_seed = np.asarray(x_seed)
+    y_seed = np.asarray(y_seed)
+
+    # Horizontal lines at y=i start their stitches at every other x, shifted by x_seed[i]
+    starts = np.arange(0, len(y_seed) - 1, 2)
+    horizontal = np.empty((len(x_seed), len(starts), 2, 2))
+    horizontal[:, :, 0, 0] = starts[None, :] + x_seed[:, None]
+    horizontal[:, :, 1, 0] = horizontal[:, :, 0, 0] + 1
+    horizontal[:, :, :, 1] = np.arange(len(x_seed))[:, None, None]
+
+    # Vertical lines at x=i start their stitches at every other y, shifted by y_seed[i]
+    starts = np.arange(0, len(x_seed) - 1, 2)
+    vertical = np.empty((len(y_seed), len(starts), 2, 2))
+    vertical[:, :, :, 0] = np.arange(len(y_seed))[:, None, None]
+    vertical[:, :, 0, 1] = starts[None, :] + y_seed[:, None]
+    vertical[:, :, 1, 1] = vertical[:, :, 0, 1] + 1
+
+    return np.concatenate((horizontal.reshape(-1, 2, 2), vertical.reshape(-1, 2, 2)))
+
+def cell_graph(x_seed: list, y_seed: list, border: bool):
+    """Returns the graph of the cells of a square hitomezashi grid, neighbouring cells are connected when no stitch separates them
+
+    Cell (r, c) is node r * num_cols + c, the last node is the outside of the pattern.
+    """
+
+    from scipy.sparse import coo_matrix
+
+    h_walls, v_walls = stitch_walls(x_seed, y_seed)
+    num_rows = len(x_seed) - 1
+    num_cols = len(y_seed) - 1
+
+    # Every cell is a node in the graph, the last node is the outside of the pattern
+    cell = np.arange(num_rows * num_cols).reshape(num_rows, num_cols)
+    outside = num_rows * num_cols
+
+    # Neighbouring cells are connected when there is no stitch between them
+    open_v = ~v_walls[1:-1].T
+    open_h = ~h_walls[1:-1]
+    source = [cell[:, :-1][open_v], cell[:-1, :][open_h]]
+    target = [cell[:, 1:][open_v], cell[1:, :][open_h]]
+
+    # Without a frame, cells on the edge are connected to the outside when there is no stitch on the edge
+    if not border:
+        source += [cell[:, 0][~v_walls[0]], cell[:, -1][~v_walls[-1]], cell[0, :][~h_walls[0]], cell[-1, :][~h_walls[-1]]]
+        target += [np.full(np.count_nonzero(~v_walls[0]), outside), np.full(np.count_nonzero(~v_walls[-1]), outside),
+                   np.full(np.count_nonzero(~h_walls[0]), outside), np.full(np.count_nonzero(~h_walls[-1]), outside)]
+
+    source = np.concatenate(source)
+    target = np.concatenate(target)
+    return coo_matrix((np.ones(len(source), dtype=np.int8), (source, target)), shape=(outside + 1, outside + 1))
+
+def cell_regions(x_seed: list, y_seed: list, border: bool):
+    """Labels the regions of a square hitomezashi grid on its cells, returns the region of every cell and of the outside (the last node)"""
+
+    from scipy.sparse.csgraph import connected_components
+
+    _, regions = connected_components(cell_graph(x_seed, y_seed, border), directed=False)
+    return regions
+
+# Neighbouring pixels of an image of a batch of grids, along the rows and columns of every grid but never from one grid to the next
+BATCH_FOOTPRINT = np.zeros((3, 3, 3), dtype=bool)
+BATCH_FOOTPRINT[1, 1, :] = True
+BATCH_FOOTPRINT[1, :, 1] = True
+
+def open_images(x_seeds: np.ndarray, y_seeds: np.ndarray, border: bool):
+    """Returns a batch of square hitomezashi grids as a (B, 2R+1, 2C+1) boolean image of their open cells and edges
+
+    Cell (r, c) of grid b is pixel (b, 2r+1, 2c+1), the edges between cells are the pixels between them and are open when they are not stitched.
+    Without a border the image gets a ring of open pixels around it, the outside of the pattern.
+    """
+
+    x_seeds = np.asarray(x_seeds)
+    y_seeds = np.asarray(y_seeds)
+    num_rows = x_seeds.shape[1] - 1
+    num_cols = y_seeds.shape[1] - 1
+
+    # The same rule as stitch_walls, on every grid of the batch at once
+    cols = np.arange(num_cols)
+    rows = np.arange(num_rows)
+    h_open = (cols[None, None, :] + x_seeds[:, :, None]) % 2 == 1
+    v_open = (rows[None, None, :] + y_seeds[:, :, None]) % 2 == 1
+
+    images = np.zeros((len(x_seeds), 2 * num_rows + 3, 2 * num_cols + 3), dtype=bool)
+    grid = images[:, 1:-1, 1:-1]
+    grid[:, 1::2, 1::2] = True
+    grid[:, 0::2, 1::2] = h_open
+    grid[:, 1::2, 0::2] = v_open.transpose(0, 2, 1)
+
+    if border:
+        # The frame closes every edge on the outline of the grid
+        grid[:, 0, :] = False
+        grid[:, -1, :] = False
+        grid[:, :, 0] = False
+        grid[:, :, -1] = False
+        return grid
+
+    images[:, 0, :] = True
+    images[:, -1, :] = True
+    images[:, :, 0] = True
+    images[:, :, -1] = True
+    return images
+
+def count_regions_batch(x_seeds: np.ndarray, y_seeds: np.ndarray, border: bool):
+    """Counts the regions of a batch of square hitomezashi patterns in one labeling pass, one per row of the seeds
+
+    With border=True the patterns are closed off by a frame and every region is counted (regions).
+    With border=False the regions connected to the outside of the pattern are not counted (loops).
+    """
+
+    from scipy.ndimage import label
+
+    images = open_images(x_seeds, y_seeds, border)
+    labels, _ = label(images, structure=BATCH_FOOTPRINT)
+
+    # Labels are numbered in scan order and the batch is the first axis, so the labels of every grid follow the labels of the grid before it
+    last = np.maximum.accumulate(labels.reshape(len(labels), -1).max(axis=1))
+    num_components = np.diff(last, prepend=0)
+
+    # Without a border the outside is one component, but it is not a region of the pattern
+    if border:
+        return num_components
+    return num_components - 1
+
+def count_loops_regions_batch(x_seeds: np.ndarray, y_seeds: np.ndarray):
+    """Counts the loops (borderless) and regions (with border) of a batch of square hitomezashi patterns, one per row of the seeds"""
+    return count_regions_batch(x_seeds, y_seeds, False), count_regions_batch(x_seeds, y_seeds, True)
+
+def merge_frontier(classes: np.ndarray, runs: np.ndarray, source: np.ndarray, target: np.ndarray):
+    """Joins the classes of the frontier and the runs of the next row along the edges from class source to run target
+
+    classes and runs tell which of them touch an unstitched edge on the outline of the pattern.
+    Returns how many classes close off because no run joins them, how many of those touch the outline, the class of every run and which of the new classes touch the outline.
+    """
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    num_nodes = len(classes) + len(runs)
+    graph = coo_matrix((np.ones(len(source), dtype=np.int8), (source, len(classes) + target)), shape=(num_nodes, num_nodes))
+    num_components, components = connected_components(graph, directed=False)
+
+    # Components with a run go on to the next row, the others are finished regions
+    carried = np.zeros(num_components, dtype=bool)
+    carried[components[len(classes):]] = True
+    touching = np.bincount(components, weights=np.concatenate((classes, runs)), minlength=num_components) > 0
+    number = np.cumsum(carried) - 1
+
+    closed = num_components - int(np.count_nonzero(carried))
+    closed_touching = int(np.count_nonzero(touching & ~carried))
+    return closed, closed_touching, number[components[len(classes):]], touching[carried]
+
+def count_loops_regions_streaming(x_seed: list, y_seed: list):
+    """Counts the loops (borderless) and regions (with border) of a square hitomezashi pattern, sweeping the grid one row of cells at a time
+
+    Only the classes of the cells of the last row are kept (the frontier), a region is counted as soon as no cell of the next row joins it.
+    Memory grows with the width of the grid and not with its area, so grids far larger than an image can be counted.
+    Without a frame the regions that touch an unstitched edge on the outline join the outside, the others are the loops.
+    """
+
+    x_seed = np.asarray(x_seed) % 2
+    y_seed = np.asarray(y_seed) % 2
+    num_rows = len(x_seed) - 1
+    num_cols = len(y_seed) - 1
+
+    # Cells of a row form runs between the stitched edges, the edge at x=i is stitched in row r when y_seed[i] has the parity of r.
+    # All even rows have the same runs, and so do all odd rows.
+    runs = [np.concatenate(([0], np.cumsum(y_seed[1:-1] == parity))) for parity in (0, 1)]
+
+    # Cells of neighbouring rows are joined through every other column, the unstitched edges of the line between them
+    columns = [np.arange(1 - bit, num_cols, 2) for bit in (0, 1)]
+
+    def edge_runs(r: int):
+        # The first and last run of row r touch the outline when the line at the edge is not stitched in that row
+        run_touching = np.zeros(runs[r % 2][-1] + 1, dtype=bool)
+        run_touching[0] |= y_seed[0] != r % 2
+        run_touching[-1] |= y_seed[-1] != r % 2
+        return run_touching
+
+    # Every run of the first row is a class of its own, touching the outline also through the line at y=0
+    touching = edge_runs(0)
+    touching[runs[0][columns[x_seed[0]]]] = True
+    frontier = np.arange(len(touching))
+
+    loops = 0
+    regions = 0
+    for r in range(1, num_rows):
+        above = columns[x_seed[r]]
+        closed, closed_touching, frontier, touching = merge_frontier(touching, edge_runs(r), frontier[runs[1 - r % 2][above]], runs[r % 2][above])
+        regions += closed
+        loops += closed - closed_touching
+
+    # The last row touches the outline through the line at the bottom
+    touching[frontier[runs[(num_rows - 1) % 2][columns[x_seed[-1]]]]] = True
+    regions += len(touching)
+    loops += len(touching) - int(np.count_nonzero(touching))
+    return loops, regions
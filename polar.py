@@ -1,100 +1,138 @@
 import argparse
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
-from  matplotlib.colors import ListedColormap
 import numpy as np
-from skimage.segmentation import flood
-from skimage.io import imread, imsave
-from skimage.color import rgb2gray
-from metbrewer import met_brew, return_met_palettes
+from colormaps import colormap_names, colormap_lut
+from labeling import white_mask, white_extent, fill_regions, color_regions, region_colors, line_coverage, draw_lines, ink_image, number_by_appearance
 from os import makedirs
-from skimage.transform import rescale
+from functools import partial, lru_cache
+from batch import pattern_seeds, run_batch
+from profiling import stage, take_records
+from os.path import getsize
+from writer import write_png
+from cache import pattern_key, cache_load, cache_store
+from recolor import save_label_map
+from vector import merge_polylines, polyline_collection, polygon_sides, region_outlines, scan_labels, region_collection, save_figure
+
+# matplotlib, skimage and scipy are imported by the functions that use them, so --help and the worker start without them
+
+@lru_cache(maxsize=8)
+def grid_geometry(
+        num_circles: int,
+        num_radial: int,
+        skip_circles: tuple
+        ):
+    """Returns every possible segment of a polar grid. Only the seeds change between patterns, so the geometry is cached."""
 
-def draw(
+    theta = np.linspace(0, 2*np.pi, num_radial)
+    radii = np.linspace(0, 1, num_circles)
+
+    # Radial lines, split into segments between consecutive circles.
+    # Radials come in pairs sharing one seed, a radial without a partner is not drawn.
+    # Segments starting on a skipped circle are not drawn.
+    x_radial = np.linspace(0, np.cos(theta), num_circles, axis=-1)
+    y_radial = (np.sin(theta) / np.cos(theta))[:, None] * x_radial
+    points = np.stack((x_radial, y_radial), -1)
+    radial = np.stack((points[:, :-1], points[:, 1:]), -2)
+    radial_drawn = (np.arange(num_radial) < num_radial - num_radial % 2)[:, None] & ~np.isin(np.arange(num_circles - 1), skip_circles)[None, :]
+
+    # Circles, split into segments between consecutive radials. Circles just outside a skipped circle are not drawn.
+    points = np.stack((radii[:, None] * np.cos(theta)[None, :], radii[:, None] * np.sin(theta)[None, :]), -1)
+    circle = np.stack((points[:, :-1], points[:, 1:]), -2)
+    circle_drawn = ~np.isin(np.arange(num_circles) - 1, skip_circles)
+
+    # Outer circle and inner circle (just outside the skipped circles)
+    points = np.stack((np.cos(np.linspace(0, 2*np.pi, 1000)), np.sin(np.linspace(0, 2*np.pi, 1000))), -1)
+    outer = np.stack((points[:-1], points[1:]), -2)
+    r = radii[np.max(skip_circles)+1]
+    points = np.stack((r*np.cos(theta), r*np.sin(theta)), -1)
+    inner = np.stack((points[:-1], points[1:]), -2)
+
+    return radial, radial_drawn, circle, circle_drawn, np.concatenate((outer, inner))
+
+def stitch_walls(
         num_circles: int,
         circle_seed: list,
         num_radial: int,
         radial_seed: list,
-        skip_circles: list,
-        random_seed: int,
-        output_path: str,
+        skip_circles: list
+        ):
+    """Returns which segments of the radials and circles of a polar hitomezashi grid are stitched"""
+
+    _, radial_drawn, _, circle_drawn, _ = grid_geometry(num_circles, num_radial, tuple(skip_circles))
+
+    # Every pair of radials uses the seed of its first radial. A stitch is drawn on every other segment, starting at the seed.
+    pair_seed = np.asarray(radial_seed)[np.arange(num_radial) - np.arange(num_radial) % 2]
+    radial_keep = radial_drawn & ((np.arange(num_circles - 1)[None, :] + pair_seed[:, None]) % 2 == 0)
+
+    circle_keep = circle_drawn[:, None] & ((np.arange(num_radial - 1)[None, :] + np.asarray(circle_seed)[:, None]) % 2 == 0)
+
+    return radial_keep, circle_keep
+
+def stitch_segments(
+        num_circles: int,
+        circle_seed: list,
+        num_radial: int,
+        radial_seed: list,
+        skip_circles: list
+        ):
+    """Returns the stitches of a polar hitomezashi grid as an (N, 2, 2) array of line segments"""
+
+    radial, _, circle, _, boundary = grid_geometry(num_circles, num_radial, tuple(skip_circles))
+    radial_keep, circle_keep = stitch_walls(num_circles, circle_seed, num_radial, radial_seed, skip_circles)
+
+    return np.concatenate((radial[radial_keep], circle[circle_keep], boundary))
+
+def save_pattern(img: np.ndarray, output_path: str, random_seed: int):
+    """Saves the uncolored pattern"""
+
+    # fill() colors the pattern in place, so the writer gets a copy
+    with stage("save_pattern") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img.copy(), record)
+
+def pattern_figure(
+        ln_coll: any,
         width: float,
         height: float,
-        dpi: int,
-        downscale: int
+        dpi: int
         ):
+    """Returns the figure and axes of a polar hitomezashi pattern with the collection of its lines drawn in"""
+
+    import matplotlib.pyplot as plt
 
     # Initialise figure. We disable most plot elements.
-    # If we downscale, we enlarge the pattern figure by the downscale factor
-    fig1 = plt.figure(figsize=(width * downscale, height * downscale))
+    fig1 = plt.figure(figsize=(width, height), dpi=dpi)
     ax1 = fig1.add_axes([0,0,1,1], frameon=False)
 
     fig1.patch.set_visible(True)
     ax1.axis('off')
     fig1.patch.set_facecolor('white')
 
-    lines = []
-    theta = np.linspace(0, 2*np.pi, num_radial)
+    # Draw our lines
+    ax1.add_collection(ln_coll)
 
-    # Draw the radiating lines
-    r = np.sqrt(1)
-    x1 = r*np.cos(theta)
-    x2 = r*np.sin(theta)
-    for i in range(0, len(x1), 2):
-        seed = radial_seed[i]
-        # Prevent index error
-        if i+1 > len(x1) - 1:
-            break
-        for j in [i,i+1]:
-            x_radial = np.linspace(0,x1[j],num_circles)
-            a = x2[j]/x1[j]
-            y_radial = a*x_radial
-            for k in range(0+seed,len(x_radial),2):
-                # Prevent index error
-                if k+1 > len(x_radial) - 1:
-                    break
-                if k in skip_circles:
-                    continue
-                lines.append(((x_radial[k], y_radial[k]), (x_radial[k+1], y_radial[k+1])))
-
-    # Draw the circles
-    radii = np.linspace(0,1,num_circles)
-    for i in range(0,len(radii)):
-        if i-1 in skip_circles:
-            continue
-        r = radii[i]
-        seed = circle_seed[i]
-        x1 = r*np.cos(theta)
-        x2 = r*np.sin(theta)
-        for j in range(0+seed, len(x1), 2):
-            # Prevent index error
-            if j+1 > len(x1) - 1:
-                break
-            # Circle lines
-            lines.append(((x1[j], x2[j]), (x1[j+1], x2[j+1])))
-
-    # Draw outer circle
-    theta = np.linspace(0, 2*np.pi, 1000)
-    r = np.sqrt(1)
-    x1 = r*np.cos(theta)
-    x2 = r*np.sin(theta)
-    for i in range(0, len(x1), 1):
-        # Prevent index error
-        if i+1 > len(x1) - 1:
-            break
-        lines.append(((x1[i], x2[i]), (x1[i+1], x2[i+1])))
-
-    # Draw inner circle
-    theta = np.linspace(0, 2*np.pi, num_radial)
-    x_radial = np.linspace(0,1,num_circles)
-    r = x_radial[np.max(skip_circles)+1]
-    x1 = r*np.cos(theta)
-    x2 = r*np.sin(theta)
-    for i in range(0, len(x1), 1):
-        # Prevent index error
-        if i+1 > len(x1) - 1:
-            break
-        lines.append(((x1[i], x2[i]), (x1[i+1], x2[i+1])))
+    plt.xlim((-1,1))
+    plt.ylim((-1,1))
+
+    return fig1, ax1
+
+def draw(
+        num_circles: int,
+        circle_seed: list,
+        num_radial: int,
+        radial_seed: list,
+        skip_circles: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        downscale: int
+        ):
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    # Generate radial, circle and boundary lines as one (N, 2, 2) array of segments
+    with stage("segments"):
+        lines = stitch_segments(num_circles, circle_seed, num_radial, radial_seed, skip_circles)
 
     # Draw our lines
     ln_coll = LineCollection(lines,
@@ -103,65 +141,383 @@ def draw(
                         zorder=8,
                         antialiased=False
                         )
-    ax1.add_collection(ln_coll)
 
-    plt.xlim((-1,1))
-    plt.ylim((-1,1))
+    # If we downscale, we enlarge the pattern figure by the downscale factor
+    fig1, _ = pattern_figure(ln_coll, width * downscale, height * downscale, dpi)
 
-    plt.savefig(output_path + "/" + str(random_seed) + ".png", dpi = dpi)
+    # Render the figure to an RGBA array, fill() colors this array directly instead of reading the pattern back from disk
+    with stage("render"):
+        fig1.canvas.draw()
+        img = np.array(fig1.canvas.buffer_rgba())
+    plt.close(fig1)
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(img, output_path, random_seed)
+
+    return img
+
+def draw_vector(
+        num_circles: int,
+        circle_seed: list,
+        num_radial: int,
+        radial_seed: list,
+        skip_circles: list,
+        random_seed: int,
+        cmap: str,
+        background: str,
+        rng: any,
+        pattern_path: str,
+        colored_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        downscale: int,
+        file_format: str
+        ):
+    """Generates a polar hitomezashi pattern and its colored regions as vector graphics (svg or pdf)
+
+    The stitches are merged into polylines and every region is one filled path, traced on the cells of the grid.
+    The figure has the size of the downscaled image, with the lines as thin as they end up after downscaling.
+    """
+
+    import matplotlib.pyplot as plt
+
+    # All lines are one path
+    with stage("segments"):
+        lines = merge_polylines(stitch_segments(num_circles, circle_seed, num_radial, radial_seed, skip_circles))
+    fig1, ax1 = pattern_figure(polyline_collection(lines, 0.5 / downscale), width, height, dpi)
+
+    # Saving the uncolored pattern is optional
+    if pattern_path is not None:
+        with stage("save_pattern") as record:
+            record["bytes"] = save_figure(fig1, pattern_path + "/" + str(random_seed) + "." + file_format, file_format)
+
+    with stage("fill") as record:
+        points, polygons = cell_polygons(num_circles, num_radial)
+        sector_walls, ring_walls = cell_walls(num_circles, circle_seed, num_radial, radial_seed, skip_circles)
+        regions = cell_regions(sector_walls, ring_walls)
+
+        # Number the regions in the order the numpy renderer finds them, by the first pixel that falls in every cell.
+        # Cells too small to hold a pixel come last, so they do not change the colors of the others.
+        nodes = pixel_cells(num_circles, num_radial, *pixel_centres(round(width * dpi), round(height * dpi)))[-1].ravel()
+        found, first = np.unique(nodes, return_index=True)
+        rows = np.full(len(regions), np.inf)
+        rows[found] = first
+        labels = scan_labels(regions, rows, np.arange(len(regions)))
+
+        # Make background transparent if requested, the four corners are the last nodes
+        background_points = []
+        if background == "transparent":
+            background_points = [(node,) for node in range(len(labels) - 4, len(labels))]
+        colors, _, record["regions"] = region_colors(labels, int(labels.max()), colormap_lut(cmap), rng, background_points, (0,0,0,0))
+
+        fig1.patch.set_facecolor("none")
+        outlines = region_outlines(points, [polygon_sides(cells, nodes) for cells, nodes in polygons], labels)
+        ax1.add_collection(region_collection(outlines, colors))
+
+    with stage("save") as record:
+        record["bytes"] = save_figure(fig1, colored_path + "/" + str(random_seed) + "." + file_format, file_format)
+    plt.close(fig1)
 
 def fill(cmap: str,
         rng: any,
         random_seed: int,
         background: str,
         downscale: int,
-        pattern_path: str,
-        output_path: str):
+        img: np.ndarray,
+        output_path: str,
+        labels_path: str = None):
     """Flood fills the hitomezashi pattern with colors from a colormap"""
 
-    my_cmap = plt.get_cmap(cmap)
+    from skimage.transform import rescale
 
-    # Load generated image
-    img = imread(pattern_path + "/" + str(random_seed) + ".png")
+    lut = colormap_lut(cmap)
 
-    # We use the grayscale image for our flood function to find patches we need to color. Grayscale color scale is from 0 (black) to 1 (white).
-    img_grey = rgb2gray(img[:,:,:3])
-    
-    # We will flood fill all white areas.
-    # Get indices of pixels we need to color.
-    ind = np.where(img_grey > 0.5)
+    # We threshold the grayscale image to find the patches we need to color, one block of rows at a time so there is no full size float copy.
+    with stage("threshold"):
+        white = white_mask(img, 0.5)
 
     # Make background transparent if requested
+    background_points = []
     if background == "transparent":
-        mask = []
-        mask.append(flood(img_grey,(ind[0][0],ind[0][0]),tolerance=0))
-        mask.append(flood(img_grey,(ind[-1][0],ind[0][-1]),tolerance=0))
-        mask.append(flood(img_grey,(ind[-1][-1],ind[-1][-1]),tolerance=0))
-        mask.append(flood(img_grey,(ind[-1][-1],ind[-1][0]),tolerance=0))
-
-        for item in mask:
-            img_grey[item] = 0
-            img[item] = (0,0,0,0)
-            ind = np.where(img_grey > 0.5)
-
-    # Each loop colors one patch
-    while len(ind[0]) > 0:
-        mask = flood(img_grey,(ind[0][0],ind[1][0]),tolerance=0)
-        color = my_cmap(rng.random(), bytes=True)[:4]
-        img[mask] = color
-        img_grey[mask] = 0
-        ind = np.where(img_grey > 0.5)
+        (first_row, first_column), (last_row, last_column) = white_extent(white)
+        background_points.append((first_row,first_row))
+        background_points.append((first_column,last_row))
+        background_points.append((last_column,last_column))
+        background_points.append((last_column,first_column))
+
+    # Each white area is one patch, colored in place. The label map is only kept if it is saved.
+    label_map = None if labels_path is None else {}
+    with stage("fill") as record:
+        record["regions"] = fill_regions(img, white, lut, rng, background_points, (0,0,0,0), label_map)
+    if labels_path is not None:
+        with stage("save_labels") as record:
+            path = labels_path + "/" + str(random_seed) + ".npz"
+            save_label_map(path, label_map, downscale)
+            record["bytes"] = getsize(path)
 
     # Downscale the image
     if downscale != 1:
-        img = rescale(img, 0.5, channel_axis=-1, anti_aliasing=True)
-        img *= 255
-        img = img.astype(np.uint8)
+        with stage("rescale"):
+            img = rescale(img, 0.5, channel_axis=-1, anti_aliasing=True)
+            img *= 255
+            img = img.astype(np.uint8)
+
+    # Save image, it is compressed in the background while the next pattern is drawn
+    with stage("save") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img, record)
+
+def cell_walls(
+        num_circles: int,
+        circle_seed: list,
+        num_radial: int,
+        radial_seed: list,
+        skip_circles: list
+        ):
+    """Returns which sides of the (ring, sector) cells of a polar hitomezashi grid are closed off by a line, boundary included
+
+    The circles are drawn as straight lines between the radials, the outer boundary is a real circle.
+    The slivers between the outer boundary and the outermost circle are an extra ring of cells.
+    """
+
+    radial_keep, circle_keep = stitch_walls(num_circles, circle_seed, num_radial, radial_seed, skip_circles)
+    num_sectors = num_radial - 1
+
+    # sector_walls[j, k] is True if sector j-1 and sector j are separated in ring k. The radials at 0 and 2*pi are the same line.
+    # The slivers only touch each other where the radials end on the outer boundary.
+    sector_walls = np.ones((num_sectors, num_circles), dtype=bool)
+    sector_walls[:, :-1] = radial_keep[:num_sectors]
+    sector_walls[0, :-1] |= radial_keep[num_sectors]
+
+    # ring_walls[i, j] is True if ring i-1 and ring i are separated in sector j, the inner boundary is closed.
+    # The circle at the centre has no length.
+    ring_walls = circle_keep.copy()
+    ring_walls[np.max(skip_circles)+1] = True
+    ring_walls[0] = False
+
+    return sector_walls, ring_walls
+
+def cell_regions(
+        sector_walls: np.ndarray,
+        ring_walls: np.ndarray
+        ):
+    """Labels the regions of a polar hitomezashi grid on the (ring, sector) cells, returns the region of every cell
+
+    Cell (k, j) is node k * num_sectors + j. The four corners outside the outer boundary are the last four nodes.
+    """
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    num_sectors, num_rings = sector_walls.shape
+    cell = np.arange(num_rings * num_sectors).reshape(num_rings, num_sectors)
+
+    # Neighbouring sectors in a ring are connected when there is no stitch between them, the last sector is next to the first.
+    # Neighbouring rings in a sector are connected when there is no stitch between them.
+    open_sector = ~sector_walls.T
+    open_ring = ~ring_walls[1:]
+    source = np.concatenate((np.roll(cell, 1, axis=1)[open_sector], cell[:-1][open_ring]))
+    target = np.concatenate((cell[open_sector], cell[1:][open_ring]))
+
+    num_nodes = num_rings * num_sectors + 4
+    graph = coo_matrix((np.ones(len(source), dtype=np.int8), (source, target)), shape=(num_nodes, num_nodes))
+    _, regions = connected_components(graph, directed=False)
+    return regions
+
+def cell_polygons(
+        num_circles: int,
+        num_radial: int
+        ):
+    """Returns the points of a polar grid and the polygons of its cells, as (points, [(polygons, nodes), ...]) with the nodes of cell_regions()
+
+    Every polygon lists its points counter-clockwise. The outer boundary and the four corners outside it follow the circle with about 1000 points.
+    """
+
+    num_sectors = num_radial - 1
+    theta = np.linspace(0, 2*np.pi, num_radial)[:-1]
+    radii = np.linspace(0, 1, num_circles)
+
+    # Point (k, j) on circle k and radial j is point 1 + (k-1) * num_sectors + j, the centre is point 0
+    points = [np.zeros((1, 2)), (radii[1:, None, None] * np.stack((np.cos(theta), np.sin(theta)), -1)).reshape(-1, 2)]
+    def point(k, j):
+        return np.where(k == 0, 0, 1 + (k - 1) * num_sectors + j % num_sectors)
+
+    # Cell (k, j) lies between circles k and k+1 and radials j and j+1
+    k, j = np.divmod(np.arange((num_circles - 1) * num_sectors), num_sectors)
+    cells = np.stack((point(k, j), point(k + 1, j), point(k + 1, j + 1), point(k, j + 1)), -1)
+    polygons = [(cells, k * num_sectors + j)]
+
+    # The slivers between the outermost circle and the outer boundary run back along the circle and out along the boundary
+    num_points = 1 + (num_circles - 1) * num_sectors
+    steps = max(int(np.ceil(1000 / num_sectors)), 1)
+    angles = theta[:, None] + 2*np.pi / num_sectors * np.arange(1, steps + 1)[None, :] / (steps + 1)
+    points.append(np.stack((np.cos(angles), np.sin(angles)), -1).reshape(-1, 2))
+    j = np.arange(num_sectors)
+    arcs = num_points + j[:, None] * steps + np.arange(steps)[None, :]
+    slivers = np.concatenate((point(num_circles - 1, j + 1)[:, None], point(num_circles - 1, j)[:, None], arcs), -1)
+    polygons.append((slivers, (num_circles - 1) * num_sectors + j))
+    num_points += num_sectors * steps
+
+    # Corner q = (x > 0) + 2 * (y < 0) runs from the boundary to the corner of the figure and back along the boundary
+    steps = 250
+    start = np.array([np.pi / 2, 0, np.pi, 3 * np.pi / 2])
+    angles = start[:, None] + np.pi / 2 * np.linspace(0, 1, steps + 2)[None, :]
+    corners = np.sign(np.stack((np.cos(start + np.pi / 4), np.sin(start + np.pi / 4)), -1))
+    corner_points = np.concatenate((np.stack((np.cos(angles[:, :1]), np.sin(angles[:, :1])), -1), corners[:, None],
+                                    np.stack((np.cos(angles[:, :0:-1]), np.sin(angles[:, :0:-1])), -1)), 1)
+    points.append(corner_points.reshape(-1, 2))
+    polygons.append((num_points + np.arange(4 * (steps + 3)).reshape(4, steps + 3), num_circles * num_sectors + np.arange(4)))
+
+    return np.concatenate(points), polygons
+
+def pixel_centres(img_width: int, img_height: int):
+    """Returns the centre of every pixel of an image of the whole polar grid in cartesian (x, y) and polar (r, theta) coordinates
+
+    Rows are counted from the top of the image.
+    """
+
+    x = -1 + (np.arange(img_width) + 0.5) / (img_width / 2)
+    y = 1 - (np.arange(img_height) + 0.5) / (img_height / 2)
+    x, y = np.meshgrid(x, y)
+    return x, y, np.hypot(x, y), np.arctan2(y, x) % (2*np.pi)
+
+def pixel_cells(
+        num_circles: int,
+        num_radial: int,
+        x: np.ndarray,
+        y: np.ndarray,
+        r: np.ndarray,
+        theta: np.ndarray
+        ):
+    """Finds the (ring, sector) cell of a polar hitomezashi grid that every point falls in
+
+    Returns the sector, the middle angle of the sector, rho, the ring and the node of cell_regions() of every point.
+    """
 
-    # Save image
-    imsave(output_path + "/" + str(random_seed) + ".png", img)
+    num_sectors = num_radial - 1
+    num_rings = num_circles - 1
+    sector_step = 2*np.pi / num_sectors
+    ring_step = 1 / num_rings
 
-def parse_args():
+    # Circles are drawn as straight lines between the radials, so the ring is found from the distance to the centre perpendicular to those lines.
+    # Past the outermost circle the point is in the sliver ring.
+    sector = np.minimum(np.floor(theta / sector_step), num_sectors - 1).astype(np.int64)
+    middle = (sector + 0.5) * sector_step
+    rho = (x * np.cos(middle) + y * np.sin(middle)) / np.cos(sector_step / 2)
+    ring = np.minimum(np.floor(rho / ring_step), num_rings).astype(np.int64)
+
+    # Points outside the outer boundary belong to one of the four corners
+    corner = (num_rings + 1) * num_sectors + (x > 0) + 2 * (y < 0)
+    nodes = np.where(r < 1, ring * num_sectors + sector, corner)
+    return sector, middle, rho, ring, nodes
+
+def rasterize(
+        num_circles: int,
+        circle_seed: list,
+        num_radial: int,
+        radial_seed: list,
+        skip_circles: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        dpi: int,
+        line_width: float
+        ):
+    """Renders a polar hitomezashi pattern at its final size without matplotlib
+
+    Returns the region label of every pixel, numbered from 1 in the order they first appear, and the anti-aliased line coverage of every pixel.
+    """
+
+    sector_walls, ring_walls = cell_walls(num_circles, circle_seed, num_radial, radial_seed, skip_circles)
+    num_sectors = num_radial - 1
+    num_rings = num_circles - 1
+    sector_step = 2*np.pi / num_sectors
+    ring_step = 1 / num_rings
+
+    # Same axis limits as draw()
+    img_width = round(width * dpi) # in pixels
+    img_height = round(height * dpi) # in pixels
+    x_scale = img_width / 2 # pixels per unit
+    y_scale = img_height / 2 # pixels per unit
+
+    # Look up the region of the cell of every pixel
+    x, y, r, theta = pixel_centres(img_width, img_height)
+    sector, middle, rho, ring, nodes = pixel_cells(num_circles, num_radial, x, y, r, theta)
+    regions = cell_regions(sector_walls, ring_walls)[nodes]
+
+    # Number the regions in the order they first appear, like labeling the rendered image does. The agg image covers the smallest cells near the centre
+    # and the thin ring at the edge with its lines, so its regions and their order, and with them the colors of a seed, differ from these
+    labels = number_by_appearance(regions.ravel()).reshape(img_height, img_width)
+
+    """
+    Lines are anti-aliased by how much of a pixel they cover across their width.
+    Only the nearest radial and the nearest circle can cover the pixel, and only if their segment at the pixel is stitched.
+    The distance in pixels is the distance in theta, rho or r divided by how fast they change per pixel.
+    """
+    radial = np.round(theta / sector_step).astype(np.int64)
+    distance = np.abs(theta - radial * sector_step) * r**2 / np.maximum(np.hypot(y / x_scale, x / y_scale), 1e-12)
+    stitched = sector_walls[radial % num_sectors, ring] & (rho < 1)
+    ink = 1 - line_coverage(distance, line_width) * stitched
+
+    circle = np.minimum(np.round(rho / ring_step), num_rings).astype(np.int64)
+    distance = np.abs(rho - circle * ring_step) * np.cos(sector_step / 2) / np.hypot(np.cos(middle) / x_scale, np.sin(middle) / y_scale)
+    stitched = ring_walls[circle, sector]
+    ink *= 1 - line_coverage(distance, line_width) * stitched
+
+    # The outer boundary
+    distance = np.abs(r - 1) * r / np.maximum(np.hypot(x / x_scale, y / y_scale), 1e-12)
+    ink *= 1 - line_coverage(distance, line_width)
+    ink = 1 - ink
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(ink_image(ink), output_path, random_seed)
+
+    return labels, ink
+
+def fill_rasterized(cmap: str,
+        rng: any,
+        random_seed: int,
+        background: str,
+        labels: np.ndarray,
+        ink: np.ndarray,
+        output_path: str,
+        labels_path: str = None):
+    """Colors the regions of a rasterized hitomezashi pattern with colors from a colormap and draws the lines over them"""
+
+    lut = colormap_lut(cmap)
+    img = np.zeros(labels.shape + (4,), dtype=np.uint8)
+
+    # The corners of the image are the four areas outside the outer circle
+    background_points = []
+    if background == "transparent":
+        background_points.append((0,0))
+        background_points.append((0,labels.shape[1]-1))
+        background_points.append((labels.shape[0]-1,labels.shape[1]-1))
+        background_points.append((labels.shape[0]-1,0))
+
+    # Each label is one patch. The label map is only kept if it is saved, the lines are drawn from the ink.
+    label_map = None if labels_path is None else {}
+    with stage("fill") as record:
+        record["regions"] = color_regions(img, labels, int(labels.max()), lut, rng, background_points, (0,0,0,0), label_map)
+    if labels_path is not None:
+        label_map["ink"] = ink
+        with stage("save_labels") as record:
+            path = labels_path + "/" + str(random_seed) + ".npz"
+            save_label_map(path, label_map)
+            record["bytes"] = getsize(path)
+
+    # Draw the black lines over the colors
+    with stage("lines"):
+        draw_lines(img, ink)
+
+    # Save image, it is compressed in the background while the next pattern is drawn
+    with stage("save") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img, record)
+
+def parse_args(argv: list = None):
     parser=argparse.ArgumentParser(
         description="Plots hitomezashi patterns in a iso grid. ",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -177,90 +533,110 @@ def parse_args():
     parser.add_argument("--height", type=float, default=5, help="Figure height in inches.")
     parser.add_argument("--background", type=str, default="transparent", help="'transparent' or 'colored' background.")
     parser.add_argument("--downscale", type=int, default=2, help="Factor by which to downscale the final image. To disable downscale, enter a value of 1.")
-    args=parser.parse_args()
+    parser.add_argument("--renderer", type=str, default="agg", choices=["agg", "numpy"], help="'agg' draws the pattern with matplotlib at the downscale factor and flood fills it, 'numpy' finds the regions on the grid cells and renders anti-aliased lines at the final size (much faster).")
+    parser.add_argument("--format", type=str, default="png", choices=["png", "svg", "pdf"], help="File format of the images. 'svg' and 'pdf' write the lines as polylines and the regions as filled paths, without rendering, caching or label maps.")
+    parser.add_argument("--no-pattern", action='store_true', help="Do not save the uncolored pattern, only the colored image.")
+    parser.add_argument("--save-labels", action='store_true', help="Save the region label map of every pattern, so it can be colored again with recolor.py.")
+    parser.add_argument("--cache", type=str, default=None, help="Directory to cache the uncolored patterns in, a pattern that is in the cache is not drawn again. No cache if not given.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Size of the cache in MB, the patterns used least recently are removed first.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to generate the patterns with. 0 will use all cores.")
+    parser.add_argument("--writers", type=int, default=1, help="Number of background threads per process that compress and write the PNG images while the next pattern is drawn. 0 writes them right away.")
+    parser.add_argument("--compression", type=int, default=6, choices=range(10), metavar="{0..9}", help="PNG compression level, from 0 (fastest, largest files) to 9 (slowest, smallest files).")
+    parser.add_argument("--profile", action='store_true', help="Time every stage of every pattern, log them to profile.jsonl in the output path and print a summary.")
+    parser.add_argument("--profile-dump", type=str, default=None, help="Run every pattern under cProfile and write the merged statistics to this file.")
+    args=parser.parse_args(argv)
     return args
 
-def main():
-    args = parse_args()
+def generate(args: any, cmaps_list: list, seed_seq: any):
+    """Draws and fills one hitomezashi pattern"""
+
     skip = [int(item) for item in args.skip.split(',')]
 
     # Paremeters of the binomial distribution
     circle_dist = 0.5
     radial_dist = 0.5
 
-    # The matplotlib colormaps
-    cmaps = {
-        "uniform": ['viridis', 'plasma', 'inferno', 'magma', 'cividis'],
-        "sequential": ['Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
-                      'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
-                      'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn'],
-        "sequential2": ['binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
-                      'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
-                      'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper'],
-        "diverging": ['PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu', 'RdYlBu',
-                      'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic',
-                      'berlin', 'managua', 'vanimo'],
-        "cyclic": ['twilight', 'twilight_shifted', 'hsv'],
-        "qualitative": ['Pastel1', 'Pastel2', 'Paired', 'Accent', 'Dark2',
-                      'Set1', 'Set2', 'Set3', 'tab10', 'tab20', 'tab20b',
-                      'tab20c'],
-        "misc": ['flag', 'prism', 'ocean', 'gist_earth', 'terrain',
-                      'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
-                      'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
-                      'turbo', 'nipy_spectral', 'gist_ncar']
-    }
-
-    # Generate n number of hitomezashi plots
-    for i in range(0,args.n):
-
-        # Initialise seed for RNG
-        if args.s ==0:
-            seed_seq = np.random.SeedSequence()
-        else:
-            seed_seq = np.random.SeedSequence(args.s)
-
-        rng = np.random.default_rng(seed_seq)
-
-        #Get cmap
-        met_palettes = return_met_palettes()
-        cmaps_list = []
-        if args.c == "all":
-            for cmap_name in cmaps:
-                for item in cmaps[cmap_name]:
-                    cmaps_list.append(item)
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        elif args.c == "metbrewer":
-            cmaps_list = []
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        else:
-             cmaps_list.append(args.c)
-
-        cmap_ind = rng.integers(0, len(cmaps_list))
-        cmap = cmaps_list[cmap_ind]
+    rng = np.random.default_rng(seed_seq)
 
-        if cmap in met_palettes:
-            colors = met_brew(cmap)
-            cmap_object = ListedColormap(colors)
-        else:
-            cmap_object = cmap
+    #Get cmap
+    cmap_ind = rng.integers(0, len(cmaps_list))
+    cmap = cmaps_list[cmap_ind]
 
-        # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    with stage("seeds"):
         circle_seed = rng.binomial(1, circle_dist, args.x1)
         radial_seed = rng.binomial(1, radial_dist, args.x2)
 
-        # Draw shape and fill
-        # Output directory is the user specified relative path + the pattern or colored folder + the number of circles + radials in the grid + the name of the colormap + the seeds number
+    # Draw shape and fill
+    # Output directory is the user specified relative path + the pattern or colored folder + the number of circles + radials in the grid + the name of the colormap + the seeds number
+    pattern_path = None
+    if not args.no_pattern:
         pattern_path = args.o + "/patterns/" + str(args.x1) + "_" + str(args.x2) + "/" + cmap + "/"
         makedirs(pattern_path, exist_ok=True)
-        draw(args.x1, circle_seed, args.x2, radial_seed, skip, seed_seq.entropy, pattern_path, args.width, args.height, 100, args.downscale)
+    colored_path = args.o + "/colored/" + str(args.x1) + "_" + str(args.x2) + "/" + cmap + "/"
+    makedirs(colored_path, exist_ok=True)
+
+    # Vector graphics are not rendered, so there is nothing to cache or label
+    if args.format != "png":
+        with stage("draw"):
+            draw_vector(args.x1, circle_seed, args.x2, radial_seed, skip, seed_seq.entropy, cmap, args.background, rng, pattern_path, colored_path,
+                        args.width, args.height, 100, args.downscale, args.format)
+        return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+    # Label maps do not depend on the colormap, they are saved once per pattern
+    labels_path = None
+    if args.save_labels:
+        labels_path = args.o + "/labels/" + str(args.x1) + "_" + str(args.x2) + "/"
+        makedirs(labels_path, exist_ok=True)
+
+    # The uncolored pattern does not depend on the colormap or the background, so it can come from the cache
+    cached = None
+    if args.cache is not None:
+        key = pattern_key("polar", [circle_seed, radial_seed], {"skip": skip, "width": args.width, "height": args.height, "dpi": 100, "downscale": args.downscale, "renderer": args.renderer})
+        with stage("cache_load"):
+            cached = cache_load(args.cache, key)
+
+    if args.renderer == "numpy":
+        if cached is not None:
+            labels, ink = cached["labels"], cached["ink"]
+            if pattern_path is not None:
+                save_pattern(ink_image(ink), pattern_path, seed_seq.entropy)
+        else:
+            # About as much ink as the aliased lines of draw() after downscaling
+            with stage("rasterize"):
+                labels, ink = rasterize(args.x1, circle_seed, args.x2, radial_seed, skip, seed_seq.entropy, pattern_path, args.width, args.height, 100, 1.6 / args.downscale)
+            if args.cache is not None:
+                with stage("cache_store") as record:
+                    record["bytes"] = cache_store(args.cache, key, {"labels": labels, "ink": ink}, args.cache_size * 2**20)
+        fill_rasterized(cmap, rng, seed_seq.entropy, args.background, labels, ink, colored_path, labels_path)
+    else:
+        if cached is not None:
+            img = cached["img"]
+            if pattern_path is not None:
+                save_pattern(img, pattern_path, seed_seq.entropy)
+        else:
+            with stage("draw"):
+                img = draw(args.x1, circle_seed, args.x2, radial_seed, skip, seed_seq.entropy, pattern_path, args.width, args.height, 100, args.downscale)
+            if args.cache is not None:
+                with stage("cache_store") as record:
+                    record["bytes"] = cache_store(args.cache, key, {"img": img}, args.cache_size * 2**20)
+        fill(cmap, rng, seed_seq.entropy, args.background, args.downscale, img, colored_path, labels_path)
+
+    return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+def main():
+    args = parse_args()
 
-        colored_path = args.o + "/colored/" + str(args.x1) + "_" + str(args.x2) + "/" + cmap + "/"
-        makedirs(colored_path, exist_ok=True)
-        fill(cmap_object, rng, seed_seq.entropy, args.background, args.downscale, pattern_path, colored_path)
+    # Colormaps we can draw from
+    cmaps_list = colormap_names(args.c)
 
-        plt.close()
+    # Generate n number of hitomezashi plots, spread over the worker processes
+    seeds = pattern_seeds(args.s, args.n)
+    profile_log = None
+    if args.profile:
+        makedirs(args.o, exist_ok=True)
+        profile_log = args.o + "/profile.jsonl"
+    run_batch(partial(generate, args, cmaps_list), seeds, args.workers, profile_log, args.profile_dump, args.writers, args.compression)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
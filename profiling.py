@@ -0,0 +1,89 @@
+import cProfile
+import json
+import pstats
+from contextlib import contextmanager
+from glob import glob
+from os import getpid
+from time import perf_counter
+
+"""
+Every pattern is made in stages (seeds, segments, render, fill, save, ...).
+stage() records the wall time of a stage, and the stage can note more about itself, like the number of regions or the bytes written.
+Stages can be nested, a stage only records the time that is not spent in the stages nested in it, so the times of all stages add up.
+The records of one pattern are collected with take_records() and logged as one JSON line per pattern:
+{"seed": "123", "seconds": 0.52, "stages": [{"stage": "seeds", "seconds": 0.0001}, {"stage": "fill", "seconds": 0.21, "regions": 2542}, ...]}
+"""
+
+# Stage records of the pattern this process is working on
+RECORDS = []
+
+# Time spent in nested stages, for every stage that is running
+NESTED = []
+
+# cProfile of all jobs this process runs
+PROFILE = None
+
+@contextmanager
+def stage(name: str):
+    """Times one stage of making a pattern, the stage can add fields like "regions" or "bytes" to the record it gets"""
+
+    record = {"stage": name}
+    NESTED.append(0)
+    start = perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = perf_counter() - start
+        record["seconds"] = elapsed - NESTED.pop()
+        if NESTED:
+            NESTED[-1] += elapsed
+        RECORDS.append(record)
+
+def take_records():
+    """Returns the stage records since the last call and starts over"""
+
+    records = list(RECORDS)
+    RECORDS.clear()
+    return records
+
+def log_entry(file: any, entry: dict):
+    """Writes the stage records of one pattern to a log as one JSON line"""
+
+    entry["seconds"] = sum(record["seconds"] for record in entry["stages"])
+    file.write(json.dumps(entry) + "\n")
+
+def print_summary(entries: list):
+    """Prints the total and mean time of every stage over all patterns, with the regions and bytes per pattern"""
+
+    totals = {}
+    for entry in entries:
+        for record in entry["stages"]:
+            total = totals.setdefault(record["stage"], {"count": 0, "seconds": 0, "regions": 0, "bytes": 0})
+            total["count"] += 1
+            total["seconds"] += record["seconds"]
+            total["regions"] += record.get("regions", 0)
+            total["bytes"] += record.get("bytes", 0)
+
+    all_seconds = sum(total["seconds"] for total in totals.values())
+    print(f"{'stage':<16}{'total s':>10}{'mean ms':>10}{'share':>8}{'regions':>10}{'kB':>10}")
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+        share = total["seconds"] / all_seconds if all_seconds > 0 else 0
+        print(f"{name:<16}{total['seconds']:>10.2f}{1000 * total['seconds'] / total['count']:>10.1f}{share:>8.1%}"
+              f"{total['regions'] / total['count']:>10.0f}{total['bytes'] / total['count'] / 1000:>10.0f}")
+
+def profiled(job: any, dump_dir: str, item: any):
+    """Runs job under cProfile, the statistics of all jobs of this process are dumped to one file in dump_dir"""
+
+    global PROFILE
+    if PROFILE is None:
+        PROFILE = cProfile.Profile()
+    result = PROFILE.runcall(job, item)
+    PROFILE.dump_stats(dump_dir + "/" + str(getpid()) + ".prof")
+    return result
+
+def merge_profiles(dump_dir: str, path: str):
+    """Merges the cProfile statistics of all worker processes into one file, readable with python -m pstats"""
+
+    stats = pstats.Stats(*glob(dump_dir + "/*.prof"))
+    stats.dump_stats(path)
+    stats.sort_stats("cumulative").print_stats(15)
@@ -0,0 +1,102 @@
+import argparse
+import numpy as np
+from os import makedirs, sep
+from os.path import basename, splitext, dirname, normpath
+from time import perf_counter
+from colormaps import colormap_names, colormap_lut, lut_colors
+from labeling import draw_lines
+
+"""
+With --save-labels, fill() stores the region label map of every pattern next to the colored images, one .npz file per pattern:
+labels      uint32 label of every pixel, 0 for the lines
+values      the random value every region was colored with, NaN for the lines and the background regions
+background  RGBA color of the background regions
+lines       RGBA pixels of the lines as uint32 (patterns drawn with matplotlib), or
+ink         line coverage of every pixel (patterns drawn with the numpy renderer)
+downscale   the colored image is rescaled by half if this is not 1, as fill() does
+Recoloring looks the values up in another colormap and gathers the colors of all pixels at once, no drawing or labeling is needed.
+"""
+
+def save_label_map(path: str, label_map: dict, downscale: int = 1):
+    """Saves the label map fill() collected for a pattern"""
+    np.savez_compressed(path, downscale=downscale, **label_map)
+
+def recolor(label_map: any, lut: np.ndarray):
+    """Returns the RGBA image of a label map colored with a colormap lookup table"""
+
+    from skimage.transform import rescale
+
+    labels = label_map["labels"]
+    values = label_map["values"]
+
+    # Regions without a value are the background, label 0 is overwritten by the lines below
+    colored = ~np.isnan(values)
+    colors = np.empty((len(values), 4), dtype=np.uint8)
+    colors[:] = label_map["background"]
+    colors[colored] = lut_colors(lut, values[colored])
+
+    # Every RGBA color is one 32 bit number, so coloring all pixels is a single gather
+    pixels = colors.view(np.uint32).ravel()[labels]
+    img = pixels.view(np.uint8).reshape(labels.shape + (4,))
+
+    if "lines" in label_map:
+        pixels[labels == 0] = label_map["lines"]
+    if "ink" in label_map:
+        draw_lines(img, label_map["ink"])
+
+    # Downscale the image the same way fill() does
+    if label_map["downscale"] != 1:
+        img = rescale(img, 0.5, channel_axis=-1, anti_aliasing=True)
+        img *= 255
+        img = img.astype(np.uint8)
+
+    return img
+
+def output_subpath(path: str):
+    """Returns the part of the path of a label map that tells it apart from others with the same seed:
+    the output path of the script that saved it and its size, e.g. square/labels/100/42.npz gives square/100
+    """
+
+    parts = normpath(dirname(path)).split(sep)
+    if "labels" not in parts:
+        return parts[-1]
+    i = len(parts) - 1 - parts[::-1].index("labels")
+    return "/".join(parts[max(i - 1, 0):i] + parts[i + 1:])
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        description="Colors hitomezashi patterns again from the label maps saved with --save-labels. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument("paths", type=str, nargs="+", help="Label maps (.npz) to recolor.")
+    parser.add_argument("-c", type=str, default="all", help="Colormap to color with. A group of colormaps (e.g. 'uniform' or 'metbrewer') colors every label map with every colormap in it.")
+    parser.add_argument("-o", type=str, default="recolored/", help="Relative path to save the images to.")
+    args=parser.parse_args()
+    return args
+
+def main():
+    from skimage.io import imsave
+
+    args = parse_args()
+    cmaps_list = colormap_names(args.c)
+
+    start = perf_counter()
+    for path in args.paths:
+        seed = splitext(basename(path))[0]
+        subpath = output_subpath(path)
+        with np.load(path) as stored:
+            label_map = {name: stored[name] for name in stored.files}
+
+        # Output directory is the user specified relative path + the output path and size of the pattern + the name of the colormap + the seed number
+        for cmap in cmaps_list:
+            img = recolor(label_map, colormap_lut(cmap))
+            makedirs(args.o + "/" + subpath + "/" + cmap, exist_ok=True)
+            imsave(args.o + "/" + subpath + "/" + cmap + "/" + seed + ".png", img, check_contrast=False)
+
+    elapsed = perf_counter() - start
+    total = len(args.paths) * len(cmaps_list)
+    print(f"Recolored {total} images in {elapsed:.2f} s ({total / elapsed:.2f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
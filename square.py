@@ -1,26 +1,40 @@
 import argparse
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
-from  matplotlib.colors import ListedColormap
 import numpy as np
-from skimage.segmentation import flood
-from skimage.io import imread, imsave
-from skimage.color import rgb2gray
-from metbrewer import met_brew, return_met_palettes
+from colormaps import colormap_names, colormap_lut
+from labeling import white_mask, white_extent, fill_regions, region_colors
+from lattice import stitch_segments, cell_regions
 from os import makedirs
-
-def draw(
-        x_seed: list,
-        y_seed: list,
-        random_seed: int,
-        output_path: str,
+from functools import partial
+from batch import pattern_seeds, run_batch
+from profiling import stage, take_records
+from os.path import getsize
+from writer import write_png
+from cache import pattern_key, cache_load, cache_store
+from recolor import save_label_map
+from vector import merge_polylines, polyline_collection, polygon_sides, region_outlines, scan_labels, region_collection, save_figure
+
+# matplotlib and skimage are imported by the functions that use them, so --help and the numpy renderer start without them
+
+def save_pattern(img: np.ndarray, output_path: str, random_seed: int):
+    """Saves the uncolored pattern"""
+
+    # fill() colors the pattern in place, so the writer gets a copy
+    with stage("save_pattern") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img.copy(), record)
+
+def pattern_figure(
+        ln_coll: any,
+        x_len: int,
+        y_len: int,
         width: float,
         height: float,
         borderless: bool,
         padding: float,
         dpi: int
         ):
-    """Generates a square hitomezashi pattern"""
+    """Returns the figure and axes of a square hitomezashi pattern with the collection of its lines drawn in"""
+
+    import matplotlib.pyplot as plt
 
     # Initialise figure.
     """
@@ -32,7 +46,7 @@ def draw(
     one_pixel = 1 / dpi # inch per pixel
     fig_width = np.round(width * (1 + padding) + one_pixel, 2) # in inches
     fig_height = np.round(height * (1 + padding) + one_pixel, 2) # in inches
-    fig1 = plt.figure(figsize=(fig_width, fig_height))
+    fig1 = plt.figure(figsize=(fig_width, fig_height), dpi=dpi)
 
     """
     Here we add the padding to the figure.
@@ -59,28 +73,37 @@ def draw(
         labelleft=False
         )
 
-    # Will contain our lines we need to draw
-    lines = []
-
-    # Generate horizontal lines
-    for i in range(0,len(x_seed)):
-        seed = x_seed[i]
-        for j in range(0,len(y_seed)-1, 2):
-            y1 = i
-            y2 = i
-            x1 = j + seed
-            x2 = j + 1 + seed
-            lines.append(((x1,y1), (x2,y2)))
-
-    # Generate vertical lines
-    for i in range(0,len(y_seed)):
-        seed = y_seed[i]
-        for j in range(0,len(x_seed)-1, 2):
-            y1 = j + seed
-            y2 = j + 1 + seed
-            x1 = i
-            x2 = i
-            lines.append(((x1,y1), (x2,y2)))
+    # Draw our lines
+    ax1.add_collection(ln_coll)
+
+    if borderless:
+        plt.xlim((-1,x_len))
+        plt.ylim((-1,y_len))
+    else:
+        plt.xlim((0,x_len-1))
+        plt.ylim((0,y_len-1))
+
+    return fig1, ax1
+
+def draw(
+        x_seed: list,
+        y_seed: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        borderless: bool,
+        padding: float,
+        dpi: int
+        ):
+    """Generates a square hitomezashi pattern"""
+
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    # Generate horizontal and vertical lines as one (N, 2, 2) array of segments
+    with stage("segments"):
+        lines = stitch_segments(x_seed, y_seed)
 
     # Draw our lines
     ln_coll = LineCollection(lines,
@@ -89,60 +112,243 @@ def draw(
                         zorder=8,
                         antialiased=False
                         )
-    ax1.add_collection(ln_coll)
+    fig1, _ = pattern_figure(ln_coll, len(x_seed), len(y_seed), width, height, borderless, padding, dpi)
+
+    # Render the figure to an RGBA array, fill() colors this array directly instead of reading the pattern back from disk
+    with stage("render"):
+        fig1.canvas.draw()
+        img = np.array(fig1.canvas.buffer_rgba())
+    plt.close(fig1)
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(img, output_path, random_seed)
+
+    return img
+
+def draw_vector(
+        x_seed: list,
+        y_seed: list,
+        random_seed: int,
+        cmap: str,
+        background: str,
+        rng: any,
+        pattern_path: str,
+        colored_path: str,
+        width: float,
+        height: float,
+        borderless: bool,
+        padding: float,
+        dpi: int,
+        file_format: str
+        ):
+    """Generates a square hitomezashi pattern and its colored regions as vector graphics (svg or pdf)
+
+    The stitches are merged into polylines and every region is one filled path, traced on the cells of the grid.
+    The regions are colored in the order labeling the rendered image finds them, so they get the same colors as with fill().
+    """
+
+    import matplotlib.pyplot as plt
+
+    # All lines are one path
+    with stage("segments"):
+        lines = merge_polylines(stitch_segments(x_seed, y_seed))
+    fig1, ax1 = pattern_figure(polyline_collection(lines, 0.5), len(x_seed), len(y_seed), width, height, borderless, padding, dpi)
+
+    # Saving the uncolored pattern is optional
+    if pattern_path is not None:
+        with stage("save_pattern") as record:
+            record["bytes"] = save_figure(fig1, pattern_path + "/" + str(random_seed) + "." + file_format, file_format)
+
+    with stage("fill") as record:
+        # Cell (r, c) has its corners at (c, r) and (c+1, r+1), corner (r, c) is point r * (num_cols + 1) + c
+        num_rows = len(x_seed) - 1
+        num_cols = len(y_seed) - 1
+        r, c = np.divmod(np.arange(num_rows * num_cols), num_cols)
+        corner = r * (num_cols + 1) + c
+        cells = np.stack((corner, corner + 1, corner + num_cols + 2, corner + num_cols + 1), -1)
+        points = np.stack(np.divmod(np.arange((num_rows + 1) * (num_cols + 1)), num_cols + 1)[::-1], -1).astype(float)
+
+        # The outside of the pattern is found first, then the cells from the top row down
+        regions = cell_regions(x_seed, y_seed, not borderless)
+        labels = scan_labels(regions, np.append(-r, -np.inf), np.append(c, -np.inf))
+        outside = len(labels) - 1
+
+        background_points = []
+        if background == "white":
+            background_points.append((outside,))
+        colors, _, record["regions"] = region_colors(labels, int(labels.max()), colormap_lut(cmap), rng, background_points, (255,255,255,255))
+
+        # The outside is the background of the figure, so it is not traced. Without a border, the cells on the edge can be part of it.
+        outlines = region_outlines(points, [polygon_sides(cells, np.arange(len(cells)))], labels)
+        outlines.pop(labels[outside], None)
+        fig1.patch.set_facecolor(colors[labels[outside]] / 255)
+        ax1.patch.set_visible(False)
+        ax1.add_collection(region_collection(outlines, colors))
+
+    with stage("save") as record:
+        record["bytes"] = save_figure(fig1, colored_path + "/" + str(random_seed) + "." + file_format, file_format)
+    plt.close(fig1)
+
+def stitch_coverage(
+        seed: np.ndarray,
+        num_units: int,
+        pixel: any,
+        low: int,
+        high: int,
+        size: int
+        ):
+    """Returns which pixels along every line of a square hitomezashi grid are covered by a stitch"""
+
+    # Stitches on line i run from j + seed[i] to j + 1 + seed[i], for every other j
+    starts = np.arange(0, num_units, 2)[None, :] + seed[:, None]
+    first = np.minimum(pixel(starts), pixel(starts + 1))
+    last = np.maximum(pixel(starts), pixel(starts + 1))
+
+    # Clip the stitches to the axes
+    first = np.maximum(first, low)
+    last = np.minimum(last, high)
+    lines = np.broadcast_to(np.arange(len(seed))[:, None], starts.shape)
+    keep = first <= last
+
+    # Mark where every stitch starts and stops, a running sum gives the covered pixels
+    first = lines[keep] * (size + 1) + first[keep]
+    last = lines[keep] * (size + 1) + last[keep] + 1
+    edges = np.bincount(first, minlength=len(seed) * (size + 1)) - np.bincount(last, minlength=len(seed) * (size + 1))
+    return np.cumsum(edges.reshape(len(seed), size + 1), axis=1)[:, :size] > 0
+
+def rasterize(
+        x_seed: list,
+        y_seed: list,
+        random_seed: int,
+        output_path: str,
+        width: float,
+        height: float,
+        borderless: bool,
+        padding: float,
+        dpi: int
+        ):
+    """Generates a square hitomezashi pattern by writing the stitches straight into an image array, without matplotlib"""
+
+    # Same figure size and padding as draw()
+    one_pixel = 1 / dpi # inch per pixel
+    fig_width = np.round(width * (1 + padding) + one_pixel, 2) # in inches
+    fig_height = np.round(height * (1 + padding) + one_pixel, 2) # in inches
+    img_width = round(fig_width * dpi) # in pixels
+    img_height = round(fig_height * dpi) # in pixels
+
+    ratio = (width * dpi) / (width * dpi * (1 + padding) + one_pixel)
+    width_padding = round(ratio * padding * (width * dpi * (1 + padding)) + 1) # in pixels
+    height_padding = round(ratio * padding * (height * dpi * (1 + padding)) + 1) # in pixels
+    left = ratio * padding / 2 * img_width # in pixels
+    bottom = ratio * padding / 2 * img_height # in pixels
+    axes_width = (1 - (width_padding / img_width)) * img_width # in pixels
+    axes_height = (1 - (height_padding / img_height)) * img_height # in pixels
 
     if borderless:
-        plt.xlim((-1,len(x_seed)))
-        plt.ylim((-1,len(y_seed)))
+        x_lim = (-1,len(x_seed))
+        y_lim = (-1,len(y_seed))
     else:
-        plt.xlim((0,len(x_seed)-1))
-        plt.ylim((0,len(y_seed)-1))
+        x_lim = (0,len(x_seed)-1)
+        y_lim = (0,len(y_seed)-1)
 
-    plt.savefig(output_path + "/" + str(random_seed) + ".png", dpi = dpi)
+    """
+    Lines of one pixel wide are snapped to the pixel grid the same way matplotlib does it: a line at position p covers pixel floor(p + 0.5).
+    Rows are counted from the top of the image, the y axis points up.
+    """
+    def column(x):
+        return np.floor(left + (x - x_lim[0]) / (x_lim[1] - x_lim[0]) * axes_width + 0.5).astype(np.int64)
+
+    def row(y):
+        return np.floor(img_height - (bottom + (y - y_lim[0]) / (y_lim[1] - y_lim[0]) * axes_height) + 0.5).astype(np.int64)
+
+    # Stitches are clipped to the axes, the frame is not
+    first_column = max(int(column(x_lim[0])), 0)
+    last_column = min(int(np.floor(left + axes_width + 0.5)), img_width) - 1
+    first_row = max(int(np.floor(img_height - (bottom + axes_height) + 0.5)), 0)
+    last_row = min(int(np.floor(img_height - bottom + 0.5)), img_height) - 1
+
+    ink = np.zeros((img_height, img_width), dtype=bool)
+
+    # Horizontal lines
+    x_seed = np.asarray(x_seed)
+    y_seed = np.asarray(y_seed)
+    rows = row(np.arange(len(x_seed)))
+    coverage = stitch_coverage(x_seed, len(y_seed)-1, column, first_column, last_column, img_width)
+    inside = np.flatnonzero((rows >= first_row) & (rows <= last_row))
+    inside = inside[np.argsort(rows[inside], kind="stable")]
+    # Lines closer together than a pixel land on the same row
+    rows, first = np.unique(rows[inside], return_index=True)
+    if len(rows) > 0:
+        ink[rows] |= np.logical_or.reduceat(coverage[inside], first, axis=0)
+
+    # Vertical lines
+    columns = column(np.arange(len(y_seed)))
+    coverage = stitch_coverage(y_seed, len(x_seed)-1, row, first_row, last_row, img_height)
+    inside = np.flatnonzero((columns >= first_column) & (columns <= last_column))
+    inside = inside[np.argsort(columns[inside], kind="stable")]
+    columns, first = np.unique(columns[inside], return_index=True)
+    if len(columns) > 0:
+        ink[:, columns] |= np.logical_or.reduceat(coverage[inside], first, axis=0).T
+
+    # Frame around the pattern
+    if not borderless:
+        left_column, right_column = column(np.array(x_lim))
+        bottom_row, top_row = row(np.array(y_lim))
+        for r in (top_row, bottom_row):
+            if 0 <= r < img_height:
+                ink[r, max(left_column, 0):right_column+1] = True
+        for c in (left_column, right_column):
+            if 0 <= c < img_width:
+                ink[max(top_row, 0):bottom_row+1, c] = True
+
+    # White background, black lines
+    img = np.full((img_height, img_width, 4), 255, dtype=np.uint8)
+    img[ink, :3] = 0
+
+    # Saving the uncolored pattern is optional
+    if output_path is not None:
+        save_pattern(img, output_path, random_seed)
+
+    return img
 
 def fill(cmap: str,
         background: str,
         rng: any,
         random_seed: int,
-        pattern_path: str,
-        output_path: str):
+        img: np.ndarray,
+        output_path: str,
+        labels_path: str = None):
     """Flood fills the hitomezashi pattern with colors from a colormap"""
 
-    my_cmap = plt.get_cmap(cmap)
+    lut = colormap_lut(cmap)
 
-    # Load generated image
-    img = imread(pattern_path + "/" + str(random_seed) + ".png")
-
-    # We use the grayscale image for our flood function to find patches we need to color. Grayscale color scale is from 0 (black) to 1 (white).
-    img_grey = rgb2gray(img[:,:,:3])
-    
-    # We will flood fill all white areas.
-    # Get indices of pixels we need to color.
-    ind = np.where(img_grey > 0.5)
+    # We threshold the grayscale image to find the patches we need to color, one block of rows at a time so there is no full size float copy.
+    with stage("threshold"):
+        white = white_mask(img, 0.5)
 
     # Make background white if requested
+    background_points = []
     if background == "white":
-        mask = []
-        mask.append(flood(img_grey,(ind[0][0],ind[0][0]),tolerance=0.5))
-
-        for item in mask:
-            img_grey[item] = 0
-            img[item] = (255,255,255,255)
-            ind = np.where(img_grey > 0.5)
+        (first_row, _), _ = white_extent(white)
+        background_points.append((first_row,first_row))
 
-    # Each loop colors one patch
-    while len(ind[0]) > 0:
-        mask = flood(img_grey,(ind[0][0],ind[1][0]),tolerance=0.5)
-        color = my_cmap(rng.random(), bytes=True)[:4]
-        img[mask] = color
-        img_grey[mask] = 0
-        ind = np.where(img_grey > 0.5)
+    # Each white area is one patch, colored in place. The label map is only kept if it is saved.
+    label_map = None if labels_path is None else {}
+    with stage("fill") as record:
+        record["regions"] = fill_regions(img, white, lut, rng, background_points, (255,255,255,255), label_map)
+    if labels_path is not None:
+        with stage("save_labels") as record:
+            path = labels_path + "/" + str(random_seed) + ".npz"
+            save_label_map(path, label_map)
+            record["bytes"] = getsize(path)
 
-    # Save image
-    imsave(output_path + "/" + str(random_seed) + ".png", img)
+    # Save image, it is compressed in the background while the next pattern is drawn
+    with stage("save") as record:
+        write_png(output_path + "/" + str(random_seed) + ".png", img, record)
 
 
-def parse_args():
+def parse_args(argv: list = None):
     parser=argparse.ArgumentParser(
         description="Plots hitomezashi patterns in a square grid. ",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -157,90 +363,100 @@ def parse_args():
     parser.add_argument("--borderless", action='store_true', help="Remove the border around the pattern.")
     parser.add_argument("--padding", type=float, default=0.04, help="Percentage of the figure height/width which is added as padding.")
     parser.add_argument("--background", type=str, default="transparent", help="'white' or 'colored' background.")
-    args=parser.parse_args()
+    parser.add_argument("--no-pattern", action='store_true', help="Do not save the uncolored pattern, only the colored image.")
+    parser.add_argument("--save-labels", action='store_true', help="Save the region label map of every pattern, so it can be colored again with recolor.py.")
+    parser.add_argument("--cache", type=str, default=None, help="Directory to cache the uncolored patterns in, a pattern that is in the cache is not drawn again. No cache if not given.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Size of the cache in MB, the patterns used least recently are removed first.")
+    parser.add_argument("--renderer", type=str, default="agg", choices=["agg", "numpy"], help="'agg' draws the pattern with matplotlib, 'numpy' writes the lines straight into the image (much faster).")
+    parser.add_argument("--format", type=str, default="png", choices=["png", "svg", "pdf"], help="File format of the images. 'svg' and 'pdf' write the lines as polylines and the regions as filled paths, without rendering, caching or label maps.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes to generate the patterns with. 0 will use all cores.")
+    parser.add_argument("--writers", type=int, default=1, help="Number of background threads per process that compress and write the PNG images while the next pattern is drawn. 0 writes them right away.")
+    parser.add_argument("--compression", type=int, default=6, choices=range(10), metavar="{0..9}", help="PNG compression level, from 0 (fastest, largest files) to 9 (slowest, smallest files).")
+    parser.add_argument("--profile", action='store_true', help="Time every stage of every pattern, log them to profile.jsonl in the output path and print a summary.")
+    parser.add_argument("--profile-dump", type=str, default=None, help="Run every pattern under cProfile and write the merged statistics to this file.")
+    args=parser.parse_args(argv)
     return args
 
 
-def main():
-    args = parse_args()
+def generate(args: any, cmaps_list: list, seed_seq: any):
+    """Draws and fills one hitomezashi pattern"""
 
     # Paremeters of the binomial distribution
     x_dist = 0.5
     y_dist = 0.5
 
-    # The matplotlib colormaps
-    cmaps = {
-        "uniform": ['viridis', 'plasma', 'inferno', 'magma', 'cividis'],
-        "sequential": ['Greys', 'Purples', 'Blues', 'Greens', 'Oranges', 'Reds',
-                      'YlOrBr', 'YlOrRd', 'OrRd', 'PuRd', 'RdPu', 'BuPu',
-                      'GnBu', 'PuBu', 'YlGnBu', 'PuBuGn', 'BuGn', 'YlGn'],
-        "sequential2": ['binary', 'gist_yarg', 'gist_gray', 'gray', 'bone',
-                      'pink', 'spring', 'summer', 'autumn', 'winter', 'cool',
-                      'Wistia', 'hot', 'afmhot', 'gist_heat', 'copper'],
-        "diverging": ['PiYG', 'PRGn', 'BrBG', 'PuOr', 'RdGy', 'RdBu', 'RdYlBu',
-                      'RdYlGn', 'Spectral', 'coolwarm', 'bwr', 'seismic',
-                      'berlin', 'managua', 'vanimo'],
-        "cyclic": ['twilight', 'twilight_shifted', 'hsv'],
-        "qualitative": ['Pastel1', 'Pastel2', 'Paired', 'Accent', 'Dark2',
-                      'Set1', 'Set2', 'Set3', 'tab10', 'tab20', 'tab20b',
-                      'tab20c'],
-        "misc": ['flag', 'prism', 'ocean', 'gist_earth', 'terrain',
-                      'gist_stern', 'gnuplot', 'gnuplot2', 'CMRmap',
-                      'cubehelix', 'brg', 'gist_rainbow', 'rainbow', 'jet',
-                      'turbo', 'nipy_spectral', 'gist_ncar']
-    }
-
-    # Generate n number of hitomezashi plots
-    for i in range(0,args.n):
-
-        # Initialise seed for RNG
-        if args.s ==0:
-            seed_seq = np.random.SeedSequence()
-        else:
-            seed_seq = np.random.SeedSequence(args.s)
-
-        rng = np.random.default_rng(seed_seq)
-
-        #Get cmap
-        met_palettes = return_met_palettes()
-        cmaps_list = []
-        if args.c == "all":
-            for cmap_name in cmaps:
-                for item in cmaps[cmap_name]:
-                    cmaps_list.append(item)
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        elif args.c == "metbrewer":
-            cmaps_list = []
-            for cmap_name in met_palettes:
-                cmaps_list.append(cmap_name)
-        else:
-             cmaps_list.append(args.c)
-
-        cmap_ind = rng.integers(0, len(cmaps_list))
-        cmap = cmaps_list[cmap_ind]
+    rng = np.random.default_rng(seed_seq)
 
-        if cmap in met_palettes:
-            colors = met_brew(cmap)
-            cmap_object = ListedColormap(colors)
-        else:
-            cmap_object = cmap
+    #Get cmap
+    cmap_ind = rng.integers(0, len(cmaps_list))
+    cmap = cmaps_list[cmap_ind]
 
-        # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    # Generate our seeds for our shape we are going to draw. These determine whether we will draw lines at even or odd coordinates.
+    with stage("seeds"):
         x_seed = rng.binomial(1, x_dist, args.x+1)
         y_seed = rng.binomial(1, y_dist, args.x+1)
 
-        # Draw shape and fill
-        # Output directory is the user specified relative path + the pattern or colored folder + the number of squares in the grid + the name of the colormap + the seeds number
+    # Draw shape and fill
+    # Output directory is the user specified relative path + the pattern or colored folder + the number of squares in the grid + the name of the colormap + the seeds number
+    pattern_path = None
+    if not args.no_pattern:
         pattern_path = args.o + "/patterns/" + str(args.x) + "/" + cmap + "/"
         makedirs(pattern_path, exist_ok=True)
-        draw(x_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, args.borderless, args.padding, 100)
+    colored_path = args.o + "/colored/" + str(args.x) + "/" + cmap + "/"
+    makedirs(colored_path, exist_ok=True)
+
+    # Vector graphics are not rendered, so there is nothing to cache or label
+    if args.format != "png":
+        with stage("draw"):
+            draw_vector(x_seed, y_seed, seed_seq.entropy, cmap, args.background, rng, pattern_path, colored_path,
+                        args.width, args.height, args.borderless, args.padding, 100, args.format)
+        return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+    # The uncolored pattern does not depend on the colormap or the background, so it can come from the cache
+    cached = None
+    if args.cache is not None:
+        key = pattern_key("square", [x_seed, y_seed], {"width": args.width, "height": args.height, "borderless": args.borderless,
+                                                        "padding": args.padding, "dpi": 100, "renderer": args.renderer})
+        with stage("cache_load"):
+            cached = cache_load(args.cache, key)
+
+    if cached is not None:
+        img = cached["img"]
+        if pattern_path is not None:
+            save_pattern(img, pattern_path, seed_seq.entropy)
+    else:
+        if args.renderer == "numpy":
+            with stage("rasterize"):
+                img = rasterize(x_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, args.borderless, args.padding, 100)
+        else:
+            with stage("draw"):
+                img = draw(x_seed, y_seed, seed_seq.entropy, pattern_path, args.width, args.height, args.borderless, args.padding, 100)
+        if args.cache is not None:
+            with stage("cache_store") as record:
+                record["bytes"] = cache_store(args.cache, key, {"img": img}, args.cache_size * 2**20)
+
+    # Label maps do not depend on the colormap, they are saved once per pattern
+    labels_path = None
+    if args.save_labels:
+        labels_path = args.o + "/labels/" + str(args.x) + "/"
+        makedirs(labels_path, exist_ok=True)
+    fill(cmap, args.background, rng, seed_seq.entropy, img, colored_path, labels_path)
+
+    return {"seed": str(seed_seq.entropy), "stages": take_records()}
+
+def main():
+    args = parse_args()
 
-        colored_path = args.o + "/colored/" + str(args.x) + "/" + cmap + "/"
-        makedirs(colored_path, exist_ok=True)
-        fill(cmap_object, args.background, rng, seed_seq.entropy, pattern_path, colored_path)
+    # Colormaps we can draw from
+    cmaps_list = colormap_names(args.c)
 
-        plt.close()
+    # Generate n number of hitomezashi plots, spread over the worker processes
+    seeds = pattern_seeds(args.s, args.n)
+    profile_log = None
+    if args.profile:
+        makedirs(args.o, exist_ok=True)
+        profile_log = args.o + "/profile.jsonl"
+    run_batch(partial(generate, args, cmaps_list), seeds, args.workers, profile_log, args.profile_dump, args.writers, args.compression)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+import json
+import numpy as np
+from math import ceil, inf, sqrt
+from os import replace
+from statistics import NormalDist
+
+"""
+Streaming statistics of a sweep, one accumulator per grid size for the loop counts and one for the region counts.
+The counts themselves are not kept: the mean and variance are accumulated with Welford's method, merging a whole batch of counts at once,
+and the counts are binned into a histogram of a fixed bin width that grows as counts outside of it come in:
+{"n": 500, "mean": 73.21, "m2": 48210.4, "bin_width": 1, "first_bin": 41, "histogram": [1, 0, 3, ...]}
+Bin k holds the counts from k * bin_width up to (k + 1) * bin_width, histogram[0] is bin first_bin.
+The statistics of a sweep are saved as one JSON file with the settings of the sweep:
+{"settings": {"root": ..., "x_dist": 0.5, "y_dist": 0.5, "bin_width": 1}, "sizes": {"10": {"loops": {...}, "regions": {...}}, ...}}
+"""
+
+def new_accumulator(bin_width: int):
+    """Returns an empty accumulator"""
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "bin_width": bin_width, "first_bin": 0, "histogram": []}
+
+def accumulate(acc: dict, values: np.ndarray):
+    """Adds a batch of counts to an accumulator"""
+
+    values = np.asarray(values)
+    if len(values) == 0:
+        return
+
+    # Mean and sum of squared differences of the batch, merged with those of the accumulator
+    num = len(values)
+    mean = float(np.mean(values))
+    m2 = float(np.sum((values - mean)**2))
+    total = acc["n"] + num
+    delta = mean - acc["mean"]
+    acc["mean"] += delta * num / total
+    acc["m2"] += m2 + delta**2 * acc["n"] * num / total
+    acc["n"] = total
+
+    # Grow the histogram to cover the bins of the batch
+    bins = np.floor_divide(values, acc["bin_width"]).astype(np.int64)
+    first = int(bins.min())
+    last = int(bins.max())
+    if acc["histogram"]:
+        first = min(first, acc["first_bin"])
+        last = max(last, acc["first_bin"] + len(acc["histogram"]) - 1)
+    histogram = np.bincount(bins - first, minlength=last - first + 1)
+    if acc["histogram"]:
+        offset = acc["first_bin"] - first
+        histogram[offset:offset + len(acc["histogram"])] += acc["histogram"]
+    acc["first_bin"] = first
+    acc["histogram"] = histogram.tolist()
+
+def variance(acc: dict):
+    """Returns the sample variance of the counts of an accumulator"""
+
+    if acc["n"] < 2:
+        return inf
+    return acc["m2"] / (acc["n"] - 1)
+
+def interval_width(acc: dict, confidence: float):
+    """Returns the width of the normal confidence interval of the mean of an accumulator"""
+
+    if acc["n"] < 2:
+        return inf
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return 2 * z * sqrt(variance(acc) / acc["n"])
+
+def samples_needed(acc: dict, width: float, confidence: float):
+    """Estimates the number of counts after which the confidence interval of the mean is narrower than width"""
+
+    if acc["n"] < 2:
+        return acc["n"] + 2
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return ceil(variance(acc) * (2 * z / width)**2)
+
+def histogram(acc: dict):
+    """Returns the bin edges and counts of the histogram of an accumulator, for plt.stairs"""
+
+    edges = (acc["first_bin"] + np.arange(len(acc["histogram"]) + 1)) * acc["bin_width"]
+    return edges, np.array(acc["histogram"], dtype=np.int64)
+
+def read_stats(path: str):
+    """Reads the statistics of a sweep, with the grid sizes as integers"""
+
+    with open(path, "r") as file:
+        stats = json.load(file)
+    stats["sizes"] = {int(x): accumulators for x, accumulators in stats["sizes"].items()}
+    return stats
+
+def write_stats(path: str, stats: dict):
+    """Saves the statistics of a sweep, replacing the old file in one step so it is never left half written"""
+
+    with open(path + ".tmp", "w") as file:
+        json.dump({"settings": stats["settings"], "sizes": {str(x): stats["sizes"][x] for x in sorted(stats["sizes"])}}, file)
+    replace(path + ".tmp", path)
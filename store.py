@@ -0,0 +1,183 @@
+import argparse
+import json
+import numpy as np
+from os import open as os_open, write, fsync, close, O_WRONLY, O_APPEND, O_CREAT
+from os.path import isfile
+from batch import child_entropies
+
+"""
+Results of a sweep are stored as JSON lines.
+The first line holds the settings of the sweep (root seed and binomial distribution), every other line holds one sample:
+{"x": 10, "i": 0, "seed": "209170859320584126450217079296634424973", "loops": 7, "regions": 12}
+Samples are only ever appended, a batch of lines is written until all of it is on disk, and an incomplete last line is skipped when reading.
+A sweep that resumes cuts it off before it appends new samples.
+
+A compact store (a path ending in .bin) starts with the same settings line, followed by one binary record per sample:
+the grid size, sample number, loops and regions as little-endian 32 bit integers, 16 bytes instead of about 90.
+The seed of a sample is not stored, it is derived again from the root seed and (x, i) with sample_seeds().
+An incomplete last record is skipped when reading and cut off when resuming, like an incomplete line.
+A record that does not read as the counts of a grid means the records lost their alignment, reading the store fails.
+"""
+
+# One sample of a compact store
+SAMPLE_DTYPE = np.dtype([("x", "<u4"), ("i", "<u4"), ("loops", "<u4"), ("regions", "<u4")])
+
+def is_compact(path: str):
+    """Returns whether a store keeps its samples as binary records"""
+    return path.endswith(".bin")
+
+def create_store(path: str, settings: dict):
+    """Creates a new store with the settings of the sweep as its first line"""
+
+    if isfile(path):
+        raise Exception(f"Store '{path}' already exists.")
+    fd = open_store(path)
+    append_record(fd, settings)
+    fsync(fd)
+    close(fd)
+
+def open_store(path: str):
+    """Opens a store for appending, returns its file descriptor"""
+    return os_open(path, O_WRONLY | O_APPEND | O_CREAT, 0o644)
+
+def write_all(fd: int, data: bytes):
+    """Writes all of data to a store, a short write (a full disk, a signal, a large batch) goes on with the rest"""
+
+    data = memoryview(data)
+    while len(data) > 0:
+        written = write(fd, data)
+        if written == 0:
+            raise Exception("Could not write to the store, no bytes were written.")
+        data = data[written:]
+
+def append_record(fd: int, record: dict):
+    """Appends one record to a store"""
+
+    # Only this process appends to the store, so a line written in parts is never split by another line
+    write_all(fd, (json.dumps(record) + "\n").encode())
+
+def append_records(fd: int, records: list):
+    """Appends many records to a store at once"""
+
+    # Whole lines written one after the other, an interrupted write leaves at most one incomplete line at the end
+    write_all(fd, "".join(json.dumps(record) + "\n" for record in records).encode())
+
+def append_samples(fd: int, records: list, compact: bool):
+    """Appends counted samples to a store, as binary records in a compact store"""
+
+    if not compact:
+        append_records(fd, records)
+        return
+
+    samples = np.array([[record[name] for name in SAMPLE_DTYPE.names] for record in records], dtype=np.int64)
+    if samples.min() < 0 or samples.max() > 0xffffffff:
+        raise Exception("Sample does not fit in a compact store.")
+    write_all(fd, samples.astype("<u4").tobytes())
+
+def read_store(path: str):
+    """Reads the settings and samples of a store, and the offset after its last complete line"""
+
+    settings = None
+    samples = []
+    end = 0
+    with open(path, "rb") as file:
+        for line in file:
+            # The last line is incomplete if the sweep was stopped while writing it
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if settings is None:
+                settings = record
+            else:
+                samples.append(record)
+            end += len(line)
+    return settings, samples, end
+
+def read_samples(path: str):
+    """Reads the settings of a store and its samples as one array per field (x, i, loops, regions, and seed if the store has them),
+    and the offset after the last complete sample
+    """
+
+    if not is_compact(path):
+        settings, samples, end = read_store(path)
+        columns = {name: np.array([record[name] for record in samples], dtype=np.int64) for name in SAMPLE_DTYPE.names}
+        columns["seed"] = [record["seed"] for record in samples]
+        return settings, columns, end
+
+    with open(path, "rb") as file:
+        header = file.readline()
+        settings = json.loads(header)
+        data = file.read()
+
+    # The last record is incomplete if the sweep was stopped while writing it
+    size = len(data) - len(data) % SAMPLE_DTYPE.itemsize
+
+    samples = np.frombuffer(data[:size], dtype=SAMPLE_DTYPE)
+    columns = {name: samples[name].astype(np.int64) for name in SAMPLE_DTYPE.names}
+
+    # Records that lost their alignment do not read as counts of a grid: the loops are some of the regions, and a grid of x squares has at most x * x regions
+    valid = (columns["x"] >= 1) & (columns["loops"] <= columns["regions"]) & (columns["regions"] <= columns["x"]**2)
+    if not valid.all():
+        offset = len(header) + int(np.argmin(valid)) * SAMPLE_DTYPE.itemsize
+        raise Exception(f"Store '{path}' has a damaged record at byte {offset}.")
+    return settings, columns, len(header) + size
+
+def sample_seeds(settings: dict, x: int, indices: np.ndarray):
+    """Returns the seed numbers of samples of a grid size, derived from the root seed of the store, as square.py -s takes them"""
+    return [str(entropy) for entropy in child_entropies(np.random.SeedSequence(settings["root"]), (x,), indices)]
+
+def load_counts(path: str, key: str):
+    """Returns the loop or region counts of a store per grid size and seed, like the old loops.json/regions.json"""
+
+    settings, samples, _ = read_samples(path)
+
+    counts = {}
+    order = np.lexsort((samples["i"], samples["x"]))
+    for x in np.unique(samples["x"]).tolist():
+        rows = order[samples["x"][order] == x]
+        if "seed" in samples:
+            seeds = [samples["seed"][row] for row in rows]
+        else:
+            seeds = sample_seeds(settings, x, samples["i"][rows])
+        counts[str(x)] = dict(zip(seeds, samples[key][rows].tolist()))
+    return counts
+
+def import_json(loops_path: str, regions_path: str, path: str):
+    """Imports loops.json and regions.json into a new store"""
+
+    with open(loops_path, "r") as file:
+        loops = json.load(file)
+    with open(regions_path, "r") as file:
+        regions = json.load(file)
+
+    # The imported samples were seeded one by one, the root seed is only used for samples added to the store later
+    create_store(path, {"root": np.random.SeedSequence().entropy, "x_dist": 0.5, "y_dist": 0.5})
+
+    fd = open_store(path)
+    for x in loops:
+        for i, seed in enumerate(loops[x]):
+            append_record(fd, {"x": int(x), "i": i, "seed": seed, "loops": loops[x][seed], "regions": regions[x][seed]})
+    fsync(fd)
+    close(fd)
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        description="Imports loops.json and regions.json into a sweep results store. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument("--loops", type=str, default="loops.json", help="Loop counts to import.")
+    parser.add_argument("--regions", type=str, default="regions.json", help="Region counts to import.")
+    parser.add_argument("-o", type=str, default="counts.jsonl", help="Store to create.")
+    args=parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+    import_json(args.loops, args.regions, args.o)
+
+
+if __name__ == "__main__":
+    main()
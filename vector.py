@@ -0,0 +1,179 @@
+import numpy as np
+from os.path import getsize
+from labeling import number_by_appearance
+
+"""
+Vector output (SVG, PDF) of hitomezashi patterns.
+The unit stitches are merged into polylines and closed loops, so a line is one path instead of one path per stitch.
+Regions are traced from the cells of the grid: the sides of a cell that are not shared with a cell of the same region outline the region.
+Every region is one path of one or more loops, outlines counter-clockwise and holes clockwise, so it fills correctly with the nonzero rule.
+"""
+
+# Without a date (and with fixed ids in SVG files) the same pattern is always written to the same file
+METADATA = {"svg": {"Date": None}, "pdf": {"CreationDate": None}}
+
+def merge_polylines(segments: np.ndarray, decimals: int = 9):
+    """Merges line segments that share end points into polylines and closed loops, returns a list of (K, 2) arrays of points
+
+    Lines pass through the points where more than two segments meet (every point of an isometric grid), so there are as few lines as possible.
+    """
+
+    # Segments meet where their end points are the same up to rounding, segments without length and segments drawn twice are dropped
+    points, ends = np.unique(np.round(segments.reshape(-1, 2), decimals), axis=0, return_inverse=True)
+    ends = ends.reshape(-1, 2)
+    ends = np.unique(np.sort(ends[ends[:, 0] != ends[:, 1]], axis=1), axis=0)
+
+    # Neighbours of every point, sorted by point
+    both = np.concatenate((ends, ends[:, ::-1]))
+    edges = np.concatenate((np.arange(len(ends)), np.arange(len(ends))))
+    order = np.argsort(both[:, 0], kind="stable")
+    neighbours = both[order, 1].tolist()
+    edges = edges[order].tolist()
+    start = np.searchsorted(both[order, 0], np.arange(len(points) + 1)).tolist()
+    degree = np.diff(start)
+
+    used = [False] * len(ends)
+
+    def walk(point):
+        # Follow unused segments until there are none left at the point reached
+        path = [point]
+        while True:
+            for k in range(start[point], start[point + 1]):
+                if not used[edges[k]]:
+                    break
+            else:
+                return path
+            used[edges[k]] = True
+            point = neighbours[k]
+            path.append(point)
+
+    # A point where an odd number of segments meet is the end of a line, lines are walked from there first.
+    # What is left after that are closed loops.
+    lines = []
+    for point in np.flatnonzero(degree % 2 == 1).tolist():
+        path = walk(point)
+        while len(path) > 1:
+            lines.append(path)
+            path = walk(point)
+    for edge in range(len(ends)):
+        if not used[edge]:
+            lines.append(walk(int(ends[edge, 0])))
+
+    return [simplify(points[path]) for path in lines]
+
+def simplify(path: np.ndarray):
+    """Drops the points of a polyline that lie on a straight line between their neighbours"""
+
+    if len(path) < 3:
+        return path
+    before = path[1:-1] - path[:-2]
+    after = path[2:] - path[1:-1]
+    cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+    dot = np.sum(before * after, axis=1)
+    turns = (np.abs(cross) > 1e-9 * np.hypot(*before.T) * np.hypot(*after.T)) | (dot < 0)
+    return path[np.concatenate(([True], turns, [True]))]
+
+def polygon_sides(cells: np.ndarray, nodes: np.ndarray):
+    """Returns the sides of polygons as (from, to, node) arrays, given the points of every polygon counter-clockwise"""
+
+    return cells.ravel(), np.roll(cells, -1, axis=1).ravel(), np.repeat(nodes, cells.shape[1])
+
+def region_outlines(points: np.ndarray, sides: list, labels: np.ndarray):
+    """Traces the outline of every region, returns a dict of region label to loops of points
+
+    sides holds the (from, to, node) arrays of the polygons of the cells, labels the region of every node.
+    """
+
+    side_from = np.concatenate([side[0] for side in sides])
+    side_to = np.concatenate([side[1] for side in sides])
+    side_label = labels[np.concatenate([side[2] for side in sides])]
+
+    # Sides of zero length (the centre of a polar grid) are not sides
+    keep = side_from != side_to
+    side_from, side_to, side_label = side_from[keep], side_to[keep], side_label[keep]
+
+    # A side is inside its region when the same side the other way around belongs to a cell of the same region
+    # A side belongs to at most two cells, one in each direction
+    num_points = len(points)
+    forward = side_from * num_points + side_to
+    backward = side_to * num_points + side_from
+    order = np.argsort(forward)
+    twin = order[np.minimum(np.searchsorted(forward[order], backward), len(order) - 1)]
+    outline = (forward[twin] != backward) | (side_label[twin] != side_label)
+    side_from, side_to, side_label = side_from[outline], side_to[outline], side_label[outline]
+
+    # Every point of an outline has as many sides coming in as going out, pairing them in order closes the loops
+    incoming = np.lexsort((side_to, side_label))
+    outgoing = np.lexsort((side_from, side_label))
+    following = np.empty(len(side_from), dtype=np.int64)
+    following[incoming] = outgoing
+    following = following.tolist()
+
+    outlines = {}
+    visited = [False] * len(side_from)
+    for first in range(len(side_from)):
+        if visited[first]:
+            continue
+        loop = []
+        side = first
+        while not visited[side]:
+            visited[side] = True
+            loop.append(side)
+            side = following[side]
+        loop = points[side_from[loop]]
+        # A loop is closed, so its first point can lie on a straight line too
+        loop = simplify(np.concatenate((loop[-1:], loop, loop[:1])))[1:-1]
+        outlines.setdefault(int(side_label[first]), []).append(loop)
+
+    return outlines
+
+def scan_labels(regions: np.ndarray, rows: np.ndarray, columns: np.ndarray):
+    """Numbers the regions of the cells from 1 in the order a row by row scan of the image meets them
+
+    rows and columns give where the scan first meets every cell, in anything that sorts like pixels.
+    """
+
+    scan = np.lexsort((columns, rows))
+    labels = np.empty(len(regions), dtype=np.int64)
+    labels[scan] = number_by_appearance(regions[scan])
+    return labels
+
+def polyline_collection(lines: list, line_width: float):
+    """Returns polylines as a matplotlib collection of a single path, so a vector file holds all lines in one element"""
+
+    from matplotlib.collections import PathCollection
+    from matplotlib.path import Path
+
+    vertices = np.concatenate(lines)
+    codes = np.concatenate([[Path.MOVETO] + [Path.LINETO] * (len(line) - 1) for line in lines])
+    return PathCollection([Path(vertices, codes)], facecolors="none", edgecolors="black", linewidths=line_width, zorder=8)
+
+def region_collection(outlines: dict, colors: np.ndarray):
+    """Returns the regions as one matplotlib collection of filled paths, regions without a visible color are left out
+
+    Regions lie inside the axes, so they are not clipped.
+    """
+
+    from matplotlib.collections import PathCollection
+    from matplotlib.path import Path
+
+    paths = []
+    facecolors = []
+    for label, loops in outlines.items():
+        if colors[label, 3] == 0:
+            continue
+        vertices = np.concatenate([np.concatenate((loop, loop[:1])) for loop in loops])
+        codes = np.concatenate([[Path.MOVETO] + [Path.LINETO] * (len(loop) - 1) + [Path.CLOSEPOLY] for loop in loops])
+        paths.append(Path(vertices, codes))
+        facecolors.append(colors[label] / 255)
+
+    return PathCollection(paths, facecolors=facecolors, edgecolors="none", linewidths=0, zorder=1, clip_on=False)
+
+def save_figure(fig1: any, path: str, file_format: str):
+    """Saves a figure as a vector graphic, returns the size of the file in bytes"""
+
+    import matplotlib
+
+    with matplotlib.rc_context({"svg.hashsalt": "hitomezashi"}):
+        fig1.savefig(path, format=file_format, metadata=METADATA[file_format])
+    return getsize(path)
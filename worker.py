@@ -0,0 +1,151 @@
+import argparse
+import json
+import signal
+import socketserver
+import sys
+from contextlib import redirect_stdout
+from importlib import import_module
+from os import remove
+from os.path import exists
+from time import perf_counter
+
+"""
+Keeps square.py, iso.py and polar.py loaded and makes patterns from jobs, one JSON object per line.
+A job names the geometry and any of the arguments of that script, with dashes or underscores:
+{"id": 1, "geometry": "square", "x": 50, "s": 42, "c": "viridis", "o": "square/", "renderer": "numpy"}
+Every pattern is answered with one JSON line as soon as it is made, and the job ends with a "done" line:
+{"id": 1, "seed": "42", "seconds": 0.08, "stages": [...]}
+{"id": 1, "done": true, "patterns": 1, "seconds": 0.08}
+A job that fails is answered with {"id": 1, "error": "..."} and the worker goes on with the next job.
+"""
+
+GEOMETRIES = ["square", "iso", "polar"]
+
+# Arguments of the scripts that are about running a batch, not about the patterns of a job
+BATCH_ARGUMENTS = ["workers", "profile", "profile_dump"]
+
+def job_args(module: any, job: dict):
+    """Returns the arguments of a job, the defaults of the script overridden by the fields of the job"""
+
+    args = module.parse_args([])
+    for key, value in job.items():
+        if key in ("id", "geometry"):
+            continue
+        name = key.replace("-", "_")
+        if not hasattr(args, name) or name in BATCH_ARGUMENTS:
+            raise ValueError(f"'{key}' is not an argument of a {job['geometry']} job")
+        setattr(args, name, value)
+    return args
+
+def run_job(job: dict, respond: any):
+    """Makes the patterns of one job, responding with one line per pattern and one when the job is done"""
+
+    from batch import pattern_seeds
+    from colormaps import colormap_names
+    from writer import start_writers, finish_writes
+
+    if job.get("geometry") not in GEOMETRIES:
+        raise ValueError(f"Geometry must be one of {', '.join(GEOMETRIES)}")
+
+    # The script is imported by the first job that needs it and stays loaded
+    module = import_module(job["geometry"])
+    args = job_args(module, job)
+    cmaps_list = colormap_names(args.c)
+
+    # Images are written in the background while the job goes on, the job is done when all of them are written
+    start = perf_counter()
+    start_writers(args.writers, args.compression)
+    seeds = pattern_seeds(args.s, args.n)
+    written = 0
+    for seed in seeds:
+        pattern_start = perf_counter()
+        result = module.generate(args, cmaps_list, seed)
+        written += sum(record.get("bytes", 0) for record in result["stages"])
+        respond({"id": job.get("id"), "seed": result["seed"], "seconds": perf_counter() - pattern_start, "stages": result["stages"]})
+    written += sum(finish_writes().values())
+    respond({"id": job.get("id"), "done": True, "patterns": len(seeds), "bytes": written, "seconds": perf_counter() - start})
+
+def serve(lines: any, respond: any):
+    """Runs the jobs of a stream of JSON lines one after the other"""
+
+    from profiling import take_records
+
+    for line in lines:
+        if not line.strip():
+            continue
+        job = {}
+        try:
+            job = json.loads(line)
+            run_job(job, respond)
+        except Exception as error:
+            # Drop what the failed job left behind, the next job starts clean
+            take_records()
+            if "matplotlib.pyplot" in sys.modules:
+                sys.modules["matplotlib.pyplot"].close("all")
+            respond({"id": job.get("id") if isinstance(job, dict) else None, "error": f"{type(error).__name__}: {error}"})
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Runs the jobs sent over one connection to the socket, answering over the same connection"""
+
+    def handle(self):
+        def respond(reply):
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+            self.wfile.flush()
+
+        serve((line.decode() for line in self.rfile), respond)
+
+def stop(signum: int, frame: any):
+    """Stops the worker on SIGTERM the same way as on Ctrl+C"""
+    raise KeyboardInterrupt
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        description="Keeps the hitomezashi scripts loaded and makes patterns from jobs sent as JSON lines on stdin or a local socket. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument("--socket", type=str, default=None, help="Path of a Unix socket to listen on for jobs. Without it, jobs are read from stdin.")
+    parser.add_argument("--preload", action='store_true', help="Import all scripts, matplotlib, skimage and the metbrewer palettes, and resolve every colormap, at start instead of with the first job that needs them.")
+    args=parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+
+    if args.preload:
+        for geometry in GEOMETRIES:
+            import_module(geometry)
+        import matplotlib.pyplot
+        import skimage.io
+        import skimage.color
+        import skimage.transform
+        import scipy.ndimage
+        # Resolving every colormap also imports the metbrewer palettes and colour behind them
+        from colormaps import colormap_names, colormap_lut
+        for cmap in colormap_names("all"):
+            colormap_lut(cmap)
+
+    # Anything the scripts print goes to stderr, stdout only carries the replies
+    replies = sys.stdout
+    with redirect_stdout(sys.stderr):
+        if args.socket is None:
+            def respond(reply):
+                replies.write(json.dumps(reply) + "\n")
+                replies.flush()
+
+            serve(sys.stdin, respond)
+        else:
+            # A socket left behind by a worker that was killed is replaced
+            if exists(args.socket):
+                remove(args.socket)
+            signal.signal(signal.SIGTERM, stop)
+            with socketserver.UnixStreamServer(args.socket, JobHandler) as server:
+                print(f"Listening on {args.socket}")
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+            remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from os import remove, replace
+from os.path import getsize, isfile
+from queue import Queue
+from threading import Thread
+
+"""
+PNG images are compressed and written by background threads, so the next pattern is drawn while the last images are still being compressed.
+Pillow lets go of the GIL while it compresses, so the writer threads run next to the drawing.
+The queue is bounded: a pattern that finds it full waits for a writer, so only a few images are held in memory.
+A write that fails stops the run. Its error is raised in the main thread by the next image that is written or when the writes are finished,
+the images still waiting are dropped. An image is written next to its path and then moved into place, so a failed write leaves no broken file
+and keeps the image an earlier run wrote.
+"""
+
+# Writer threads of this process and the images waiting for them. Without threads every image is written right away.
+THREADS = []
+QUEUE = None
+
+# Images waiting per writer thread
+QUEUE_PER_THREAD = 2
+
+# zlib compression level of the PNG images, 6 is what imsave uses
+COMPRESS_LEVEL = 6
+
+# Error of a failed background write, raised again in the main thread
+ERRORS = []
+
+# Size in bytes of every image written in the background since the writes were last finished, by path
+WRITTEN = {}
+
+def encode_png(path: str, img: any, compress_level: int):
+    """Writes an RGBA image as a PNG file, returns the size of the file in bytes"""
+
+    from PIL import Image
+
+    try:
+        Image.fromarray(img).save(path + ".tmp", format="PNG", compress_level=compress_level)
+        replace(path + ".tmp", path)
+    except Exception as error:
+        # Leave no broken image behind
+        if isfile(path + ".tmp"):
+            remove(path + ".tmp")
+        raise Exception(f"Could not write '{path}': {error}") from error
+    return getsize(path)
+
+def write_loop():
+    """Writes the images of the queue until it gets None"""
+
+    while True:
+        item = QUEUE.get()
+        try:
+            # After a failed write the images still waiting are dropped
+            if item is not None and not ERRORS:
+                WRITTEN[item[0]] = encode_png(*item)
+        except Exception as error:
+            ERRORS.append(error)
+        finally:
+            QUEUE.task_done()
+        if item is None:
+            return
+
+def start_writers(threads: int, compress_level: int = 6):
+    """Starts the writer threads of this process, with 0 threads every image is written right away"""
+
+    global QUEUE, COMPRESS_LEVEL
+
+    stop_writers()
+    COMPRESS_LEVEL = compress_level
+    if threads > 0:
+        QUEUE = Queue(maxsize=QUEUE_PER_THREAD * threads)
+        for _ in range(threads):
+            thread = Thread(target=write_loop, daemon=True)
+            thread.start()
+            THREADS.append(thread)
+
+def write_png(path: str, img: any, record: dict = None):
+    """Writes an RGBA image as a PNG file, in the background if there are writer threads
+
+    The image must not change until it is written. The path is noted in record, and the size of the file if it is written right away,
+    otherwise finish_writes() returns it and note_sizes() adds it to the record.
+    """
+
+    raise_errors()
+    if record is not None:
+        record["path"] = path
+    if not THREADS:
+        size = encode_png(path, img, COMPRESS_LEVEL)
+        if record is not None:
+            record["bytes"] = size
+        return
+    QUEUE.put((path, img, COMPRESS_LEVEL))
+
+def raise_errors():
+    """Raises the error of a failed background write"""
+
+    if ERRORS:
+        raise ERRORS[0]
+
+def finish_writes():
+    """Waits until all images are written, raises the error of a failed write, returns the sizes of the images written in the background"""
+
+    if THREADS:
+        QUEUE.join()
+    if ERRORS:
+        error = ERRORS[0]
+        ERRORS.clear()
+        WRITTEN.clear()
+        raise error
+    sizes = dict(WRITTEN)
+    WRITTEN.clear()
+    return sizes
+
+def stop_writers():
+    """Stops the writer threads after the images they have, forgetting failed writes"""
+
+    for _ in THREADS:
+        QUEUE.put(None)
+    for thread in THREADS:
+        thread.join()
+    THREADS.clear()
+    ERRORS.clear()
+    WRITTEN.clear()
+
+def flush_writes(barrier: any):
+    """Waits until all images of this worker process are written, raises the error of a failed write, returns the sizes of the images
+
+    The barrier holds the process until every worker process has taken one flush, so none of them takes two.
+    """
+
+    barrier.wait()
+    return finish_writes()
+
+def note_sizes(stages: list, sizes: dict):
+    """Adds the sizes of the images written in the background to the stage records that handed them over"""
+
+    for record in stages:
+        if "path" in record and record["path"] in sizes:
+            record["bytes"] = sizes[record["path"]]